@@ -0,0 +1,192 @@
+#! /usr/bin/env python
+#
+# SCons - a Software Constructor
+#
+# Copyright (c) 2001 - 2019 The SCons Foundation
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY
+# KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+'''Serve a directory as a remote tier for SCons cache directories.
+
+This is a minimal reference implementation of the HTTP protocol that
+CacheDir's remote backend speaks:
+
+    GET  /<signature>   the entry, or 404 if there isn't one
+    HEAD /<signature>   the same, without the body
+    PUT  /<signature>   store an entry (the request body)
+
+The entry's permission bits are passed in an X-SCons-Mode header, in
+octal, both ways.
+
+Entries are kept in the served directory using the same layout as a
+local cache directory.  To have a cache use it, add
+
+    "remote": "http://<host>:<port>"
+
+to the cache directory's config file.  There is no authentication or
+eviction; this is meant for testing and for small trusted networks.
+'''
+
+from __future__ import print_function
+import argparse
+import os
+import re
+import shutil
+import threading
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+__revision__ = "src/script/scons-cache-server.py bee7caf9defd6e108fc2998a2520ddb36a967691 2019-12-17 02:07:09 bdeegan"
+
+__version__ = "3.1.2"
+
+__build__ = "bee7caf9defd6e108fc2998a2520ddb36a967691"
+
+__buildsys__ = "octodog"
+
+__date__ = "2019-12-17 02:07:09"
+
+__developer__ = "bdeegan"
+
+
+key_re = re.compile(r'^/([0-9A-Za-z_-]+)$')
+
+prefix_len = 2
+
+counter_lock = threading.Lock()
+counter = [0]
+
+
+class CacheRequestHandler(BaseHTTPRequestHandler):
+
+    def entry_path(self):
+        m = key_re.match(self.path)
+        if not m:
+            self.send_error(400, "Bad cache key")
+            return None
+        key = m.group(1)
+        return os.path.join(self.server.root, key[:prefix_len].upper(), key)
+
+    def send_entry(self, body):
+        path = self.entry_path()
+        if path is None:
+            return
+        try:
+            f = open(path, 'rb')
+        except IOError:
+            self.send_error(404, "Not in cache")
+            return
+        with f:
+            st = os.fstat(f.fileno())
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(st.st_size))
+            self.send_header('X-SCons-Mode', '%o' % (st.st_mode & 0o777))
+            self.end_headers()
+            if body:
+                shutil.copyfileobj(f, self.wfile, 1024*1024)
+
+    def do_GET(self):
+        self.send_entry(True)
+
+    def do_HEAD(self):
+        self.send_entry(False)
+
+    def do_PUT(self):
+        path = self.entry_path()
+        if path is None:
+            return
+        try:
+            length = int(self.headers['Content-Length'])
+        except (TypeError, ValueError):
+            self.send_error(411, "Content-Length required")
+            return
+        with counter_lock:
+            counter[0] += 1
+            tempfile = '%s.tmp%d-%d' % (path, os.getpid(), counter[0])
+        try:
+            dir = os.path.dirname(path)
+            if not os.path.isdir(dir):
+                try:
+                    os.makedirs(dir)
+                except OSError:
+                    if not os.path.isdir(dir):
+                        raise
+            with open(tempfile, 'wb') as f:
+                while length > 0:
+                    data = self.rfile.read(min(length, 1024*1024))
+                    if not data:
+                        break
+                    f.write(data)
+                    length -= len(data)
+            if length > 0:
+                os.unlink(tempfile)
+                self.send_error(400, "Short request body")
+                return
+            try:
+                os.chmod(tempfile, int(self.headers['X-SCons-Mode'], 8) & 0o777)
+            except (TypeError, ValueError):
+                pass
+            os.rename(tempfile, path)
+        except EnvironmentError as e:
+            self.send_error(500, str(e))
+            return
+        self.send_response(201)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class CacheServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+parser = argparse.ArgumentParser(
+    description='Serve a directory as a remote SCons cache')
+parser.add_argument('directory', help='Directory to keep cache entries in')
+parser.add_argument('--host', default='127.0.0.1',
+                    help='Address to listen on (default: %(default)s)')
+parser.add_argument('--port', type=int, default=8080,
+                    help='Port to listen on (default: %(default)s)')
+parser.add_argument('-v', '--verbose', action='store_true',
+                    help='Log every request')
+
+args = parser.parse_args()
+
+if not os.path.isdir(args.directory):
+    os.makedirs(args.directory)
+
+server = CacheServer((args.host, args.port), CacheRequestHandler)
+server.root = os.path.abspath(args.directory)
+server.verbose = args.verbose
+print("Serving cache entries in %s on http://%s:%d" %
+      (server.root, args.host, server.server_address[1]))
+try:
+    server.serve_forever()
+except KeyboardInterrupt:
+    pass
@@ -77,6 +77,16 @@ def rearrange_cache_entries(current_prefix_len, new_prefix_len):
         os.rmdir(dname)
 
 
+def remove_manifest(current_value, new_value):
+    '''Remove the list of cache entries when the manifest is turned off.
+
+    Builds don't keep the list up to date while it's off, so it would be
+    missing entries if it got turned back on.
+    '''
+    if new_value == 'no' and os.path.exists('manifest'):
+        os.unlink('manifest')
+
+
 # The configuration dictionary should have one entry per entry in the
 # cache config. The value of each entry should include the following:
 #   implicit - (optional) This is to allow adding a new config entry and also
@@ -98,6 +108,57 @@ config_entries = {
             'type': int
         },
         'converter': rearrange_cache_entries
+    },
+    'max_size': {
+        'default': 0,
+        'command-line': {
+            'help': 'Maximum size of the cache, in bytes or with a K, M, G '
+                    'or T suffix; 0 means no limit',
+            'metavar': '<size>',
+            'type': str
+        }
+    },
+    'max_age': {
+        'default': 0,
+        'command-line': {
+            'help': 'Remove cache entries not used for this long, in '
+                    'seconds or with an m, h or d suffix; 0 means no limit',
+            'metavar': '<age>',
+            'type': str
+        }
+    },
+    'compression': {
+        'default': 'none',
+        'command-line': {
+            'help': 'Compress new cache entries: none or gzip',
+            'choices': ['none', 'gzip']
+        }
+    },
+    'bundles': {
+        'default': 'no',
+        'command-line': {
+            'help': 'Cache the targets of multi-target builders together '
+                    'as single entries: yes or no',
+            'choices': ['yes', 'no']
+        }
+    },
+    'manifest': {
+        'default': 'no',
+        'command-line': {
+            'help': 'Keep a list of the entries in the cache so builds '
+                    'can rule out misses without touching the file '
+                    'system: yes or no',
+            'choices': ['yes', 'no']
+        },
+        'converter': remove_manifest
+    },
+    'signatures': {
+        'default': 'no',
+        'command-line': {
+            'help': 'Record what went into the signature of each cached '
+                    'target, for --cache-explain: yes or no',
+            'choices': ['yes', 'no']
+        }
     }
 }
 
@@ -27,14 +27,26 @@ __doc__ = """
 CacheDir support
 """
 
+import SCons.compat
+
+import errno
+import gzip
 import hashlib
 import json
 import os
+import queue
+import shutil
 import stat
 import sys
+import tarfile
+import threading
+import time
+import zlib
 
 import SCons
 import SCons.Action
+import SCons.Timeline
+import SCons.Util
 import SCons.Warnings
 from SCons.Util import PY3
 
@@ -44,28 +56,263 @@ cache_force = False
 cache_show = False
 cache_readonly = False
 
+# Size-bounded caches:  a cache whose config has a "max_size" (in bytes,
+# or with a K/M/G/T suffix) and/or a "max_age" (in seconds, or with an
+# m/h/d suffix) gets trimmed at the end of each build that used it.
+# Entries are ranked by modification time, which CacheRetrieveFunc
+# bumps on every hit, so the least recently used ones go first.
+#
+# To keep from scanning a big shared cache after every build, a small
+# side file (trim_state_file) records the total size found by the last
+# scan plus whatever builds have pushed since then; a full scan only
+# happens once that estimate exceeds max_size, or when the last scan is
+# older than trim_scan_interval seconds (which is also how max_age gets
+# enforced).  A lock file keeps concurrent builds from trimming the same
+# cache at once; a lock older than stale_lock_age seconds is assumed to
+# have been left behind by a build that died.
+trim_state_file = 'trim-state'
+trim_lock_file = 'trim.lock'
+trim_scan_interval = 24*60*60
+stale_lock_age = 60*60
+
+# Trimming removes entries until the cache is at or below this fraction
+# of max_size, so it doesn't have to run again right after the next push.
+trim_low_water = 0.9
+
+# Temporary files that interrupted pushes left behind get removed once
+# they're older than this many seconds.
+stale_tmp_age = 24*60*60
+
+# Maps the path of each cache directory with a size or age limit to its
+# CacheDir object, and the path of every cache directory to the number
+# of bytes this build pushed into it.
+trimmed_caches = {}
+pushed_bytes = {}
+
+def _config_value(value, units, name):
+    """
+    Converts a "max_size" or "max_age" config value, which may be a
+    number or a string with a unit suffix, to a number.
+    """
+    if value is None:
+        return 0
+    if SCons.Util.is_String(value):
+        v = value.strip()
+        multiplier = 1
+        if v and v[-1].lower() in units:
+            multiplier = units[v[-1].lower()]
+            v = v[:-1]
+        try:
+            value = float(v) * multiplier
+        except ValueError:
+            value = -1
+    if not isinstance(value, (int, float)) or isinstance(value, bool) or value < 0:
+        msg = "Invalid value for %s in cache configuration: %s" % (name, repr(value))
+        raise SCons.Errors.SConsEnvironmentError(msg)
+    return int(value)
+
+def _config_flag(value):
+    """
+    Converts an on/off config value to a bool.  scons-configure-cache.py
+    writes these as "yes" or "no".
+    """
+    if SCons.Util.is_String(value):
+        return value.strip().lower() in ('yes', 'true', 'on', '1')
+    return bool(value)
+
+size_units = {'k': 1024, 'm': 1024**2, 'g': 1024**3, 't': 1024**4}
+age_units = {'s': 1, 'm': 60, 'h': 60*60, 'd': 24*60*60}
+
+# Compressed caches:  a cache whose config has "compression": "gzip"
+# stores each entry as compressed_magic followed by a gzip stream of the
+# file's contents (unless compressing doesn't make the entry smaller, in
+# which case it's stored as is).  Retrieval looks at the first bytes of
+# an entry, so a cache can hold a mix of compressed and plain entries,
+# and turning compression on or off never invalidates what's there.
+# Compressed entries are decompressed straight into the target, rather
+# than through the environment's copy_from_cache function.
+compression_types = ('none', 'gzip')
+compress_level = 6
+compressed_magic = b'\x89SConsGZ'
+
+def _is_compressed(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(compressed_magic)) == compressed_magic
+    except EnvironmentError:
+        return False
+
+def _compress_file(src, dst):
+    """
+    Writes a compressed copy of src to dst.  Returns False, having
+    written nothing useful, if it came out no smaller than src.
+    """
+    with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+        fout.write(compressed_magic)
+        gz = gzip.GzipFile(fileobj=fout, mode='wb',
+                           compresslevel=compress_level, mtime=0)
+        try:
+            shutil.copyfileobj(fin, gz, 1024*1024)
+        finally:
+            gz.close()
+        return fout.tell() < os.fstat(fin.fileno()).st_size
+
+def _decompress_file(src, dst):
+    with open(src, 'rb') as fin:
+        fin.seek(len(compressed_magic))
+        gz = gzip.GzipFile(fileobj=fin, mode='rb')
+        try:
+            with open(dst, 'wb') as fout:
+                shutil.copyfileobj(gz, fout, 1024*1024)
+        finally:
+            gz.close()
+
+# How plain (uncompressed) entries are put in place on a cache hit:
+#   copy      - with the environment's copy_from_cache function
+#   reflink   - as a copy-on-write clone, where the file system has them
+#   hardlink  - as a hard link to the cache entry, when it's on the same
+#               file system; both are made read-only so a later build
+#               step can't modify the cached copy in place.  Precious
+#               targets, which SCons deliberately doesn't remove before
+#               rebuilding them, are never hard linked.
+#   auto      - reflink, else hardlink, else copy
+# Whatever can't be linked or cloned gets copied.
+retrieve_strategies = ('copy', 'reflink', 'hardlink', 'auto')
+retrieve_strategy = 'copy'
+
+# Linux ioctl that clones one file's extents into another.
+_FICLONE = 0x40049409
+
+# Errors that mean a strategy isn't available at all here, as opposed to
+# having failed for one particular file; after one of these we stop
+# trying that strategy for the rest of the build.
+_unsupported_errors = set([getattr(errno, name) for name in
+                           ('EXDEV', 'EPERM', 'EOPNOTSUPP', 'ENOTSUP',
+                            'ENOTTY', 'EINVAL', 'ENOSYS', 'EMLINK')
+                           if hasattr(errno, name)])
+
+_can_reflink = True
+_can_hardlink = hasattr(os, 'link')
+
+def _reflink(src, dst):
+    global _can_reflink
+    if not _can_reflink:
+        return False
+    try:
+        if sys.platform.startswith('linux'):
+            import fcntl
+            with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+                fcntl.ioctl(fout.fileno(), _FICLONE, fin.fileno())
+        elif sys.platform == 'darwin':
+            import ctypes
+            import ctypes.util
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            if os.path.lexists(dst):
+                os.unlink(dst)
+            if libc.clonefile(src.encode(), dst.encode(), 0) != 0:
+                e = ctypes.get_errno()
+                raise OSError(e, os.strerror(e))
+        else:
+            _can_reflink = False
+            return False
+    except (EnvironmentError, ImportError, AttributeError) as e:
+        if getattr(e, 'errno', None) in _unsupported_errors or \
+           not isinstance(e, EnvironmentError):
+            _can_reflink = False
+        try:
+            os.unlink(dst)
+        except OSError:
+            pass
+        return False
+    return True
+
+def _hardlink(src, dst):
+    global _can_hardlink
+    if not _can_hardlink:
+        return False
+    try:
+        if os.path.lexists(dst):
+            os.unlink(dst)
+        os.link(src, dst)
+    except OSError as e:
+        if e.errno in _unsupported_errors:
+            _can_hardlink = False
+        return False
+    return True
+
+def _link_from_cache(cachefile, node):
+    """
+    Puts cachefile in place as node's file without copying it, if the
+    retrieve_strategy allows.  Returns 'reflink' or 'hardlink' to say
+    how, or None if the caller has to copy it.
+    """
+    dst = node.get_internal_path()
+    if retrieve_strategy in ('reflink', 'auto') and _reflink(cachefile, dst):
+        return 'reflink'
+    if retrieve_strategy in ('hardlink', 'auto') and not node.precious and \
+       _hardlink(cachefile, dst):
+        return 'hardlink'
+    return None
+
 def CacheRetrieveFunc(target, source, env):
     t = target[0]
     fs = t.fs
     cd = env.get_CacheDir()
     cd.requests += 1
     cachedir, cachefile = cd.cachepath(t)
-    if not fs.exists(cachefile):
+    if not cd.in_cache(cachefile):
         cd.CacheDebug('CacheRetrieve(%s):  %s not in cache\n', t, cachefile)
         return 1
     cd.hits += 1
     cd.CacheDebug('CacheRetrieve(%s):  retrieving from %s\n', t, cachefile)
     if SCons.Action.execute_actions:
+        linked = None
         if fs.islink(cachefile):
             fs.symlink(fs.readlink(cachefile), t.get_internal_path())
+        elif _is_compressed(cachefile):
+            try:
+                _decompress_file(cachefile, t.get_internal_path())
+            except (EnvironmentError, EOFError, zlib.error):
+                # A truncated or vanished entry is just a miss.
+                try:
+                    os.unlink(t.get_internal_path())
+                except OSError:
+                    pass
+                cd.hits -= 1
+                cd.CacheDebug('CacheRetrieve(%s):  %s could not be decompressed\n', t, cachefile)
+                return 1
+            try:
+                os.utime(cachefile, None)
+            except OSError:
+                pass
         else:
-            env.copy_from_cache(cachefile, t.get_internal_path())
+            try:
+                if retrieve_strategy != 'copy':
+                    linked = _link_from_cache(cachefile, t)
+                if linked is None:
+                    env.copy_from_cache(cachefile, t.get_internal_path())
+                else:
+                    cd.CacheDebug('CacheRetrieve(%s):  ' + linked + 'ed %s\n', t, cachefile)
+            except EnvironmentError:
+                # Another build may have trimmed the entry between our
+                # check and the copy; that's just a miss.
+                if fs.exists(cachefile):
+                    raise
+                cd.hits -= 1
+                cd.CacheDebug('CacheRetrieve(%s):  %s was removed from cache\n', t, cachefile)
+                return 1
             try:
                 os.utime(cachefile, None)
             except OSError:
                 pass
         st = fs.stat(cachefile)
-        fs.chmod(t.get_internal_path(), stat.S_IMODE(st[stat.ST_MODE]) | stat.S_IWRITE)
+        if linked == 'hardlink':
+            # This changes the cache entry too, which is the point.
+            mode = stat.S_IMODE(st[stat.ST_MODE])
+            fs.chmod(t.get_internal_path(),
+                     mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+        else:
+            fs.chmod(t.get_internal_path(), stat.S_IMODE(st[stat.ST_MODE]) | stat.S_IWRITE)
     return 0
 
 def CacheRetrieveString(target, source, env):
@@ -73,7 +320,7 @@ def CacheRetrieveString(target, source, env):
     fs = t.fs
     cd = env.get_CacheDir()
     cachedir, cachefile = cd.cachepath(t)
-    if t.fs.exists(cachefile):
+    if cd.in_cache(cachefile):
         return "Retrieved `%s' from cache" % t.get_internal_path()
     return None
 
@@ -99,32 +346,25 @@ def CachePushFunc(target, source, env):
         # other person running the same build pushes their copy to
         # the cache after we decide we need to build it but before our
         # build completes.
+        cd.record(cachefile)
         cd.CacheDebug('CachePush(%s):  %s already exists in cache\n', t, cachefile)
         return
 
     cd.CacheDebug('CachePush(%s):  pushing to %s\n', t, cachefile)
 
-    tempfile = cachefile+'.tmp'+str(os.getpid())
     errfmt = "Unable to copy %s to cache. Cache file is %s"
 
-    if not fs.isdir(cachedir):
-        try:
-            fs.makedirs(cachedir)
-        except EnvironmentError:
-            # We may have received an exception because another process
-            # has beaten us creating the directory.
-            if not fs.isdir(cachedir):
-                msg = errfmt % (str(target), cachefile)
-                raise SCons.Errors.SConsEnvironmentError(msg)
+    _make_cachedir(fs, cachedir, errfmt % (str(target), cachefile))
+
+    if push_threads > 0:
+        _push_queue().put(_push_file, (fs, t.get_internal_path(), cd),
+                          cachefile, errfmt % (str(target), cachefile))
+        return
 
+    tempfile = cachefile+'.tmp'+str(os.getpid())
     try:
-        if fs.islink(t.get_internal_path()):
-            fs.symlink(fs.readlink(t.get_internal_path()), tempfile)
-        else:
-            fs.copy2(t.get_internal_path(), tempfile)
-        fs.rename(tempfile, cachefile)
-        st = fs.stat(t.get_internal_path())
-        fs.chmod(cachefile, stat.S_IMODE(st[stat.ST_MODE]) | stat.S_IWRITE)
+        if _push_file(fs, t.get_internal_path(), cd, cachefile, tempfile):
+            cd.CacheDebug('CachePush(%s):  compressed %s\n', t, cachefile)
     except EnvironmentError:
         # It's possible someone else tried writing the file at the
         # same time we did, or else that there was some problem like
@@ -134,8 +374,575 @@ def CachePushFunc(target, source, env):
         msg = errfmt % (str(target), cachefile)
         SCons.Warnings.warn(SCons.Warnings.CacheWriteErrorWarning, msg)
 
+def _make_cachedir(fs, cachedir, errmsg):
+    if not fs.isdir(cachedir):
+        try:
+            fs.makedirs(cachedir)
+        except EnvironmentError:
+            # We may have received an exception because another process
+            # has beaten us creating the directory.
+            if not fs.isdir(cachedir):
+                raise SCons.Errors.SConsEnvironmentError(errmsg)
+
+def _push_file(fs, src, cd, cachefile, tempfile):
+    """
+    Copies (or compresses) src into the cache as cachefile by way of
+    tempfile.  Returns whether the entry was compressed; raises
+    EnvironmentError if it couldn't be written.
+
+    This only does file system work on paths it's handed, so the cache
+    push threads can call it.
+    """
+    compressed = False
+    if fs.islink(src):
+        fs.symlink(fs.readlink(src), tempfile)
+    elif cd.compression == 'gzip' and _compress_file(src, tempfile):
+        compressed = True
+    else:
+        fs.copy2(src, tempfile)
+    fs.rename(tempfile, cachefile)
+    st = fs.stat(src)
+    fs.chmod(cachefile, stat.S_IMODE(st[stat.ST_MODE]) | stat.S_IWRITE)
+    _pushed(cd, cachefile)
+    return compressed
+
+def _pushed(cd, cachefile):
+    """
+    Does the bookkeeping for a new entry in the cache:  counts its size
+    against the cache's limits and uploads it to the remote store.
+    """
+    size = os.lstat(cachefile).st_size
+    with _pushed_bytes_lock:
+        pushed_bytes[cd.path] = pushed_bytes.get(cd.path, 0) + size
+    cd.record(cachefile)
+    if cd.remote is not None and not cd.remote_readonly and \
+       not os.path.islink(cachefile):
+        key = os.path.basename(cachefile)
+        if not cd.remote.exists(key):
+            cd.remote.store(key, cachefile)
+
+# Asynchronous pushes:  with push_threads set above zero, CachePushFunc
+# only works out where a target goes (which needs the target's signature,
+# and so has to happen in the main thread) and leaves the copying to a
+# pool of push_threads background threads, so a slow cache file system
+# doesn't hold up the scheduling of the targets that depend on it.  At
+# most push_queue_size pushes wait in the queue; past that, CachePushFunc
+# blocks until there's room, which bounds the memory used.  Failures are
+# reported as CacheWriteErrorWarnings from the main thread, the next time
+# it pushes something or when wait_for_pushes() drains the queue at the
+# end of the build.
+push_threads = 0
+push_queue_size = 256
+
+_pushed_bytes_lock = threading.Lock()
+
+class PushQueue(object):
+    """
+    A bounded queue of pending cache pushes and the threads that carry
+    them out.
+    """
+    def __init__(self, num_threads, maxsize):
+        self.queue = queue.Queue(maxsize)
+        self.errors = []
+        self.count = 0
+        self.threads = []
+        for _ in range(num_threads):
+            thread = threading.Thread(target=self._run)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def put(self, func, args, cachefile, errmsg):
+        """
+        Queues a call of func(*args, cachefile, tempfile), which has to
+        write the entry to tempfile and rename it to cachefile.
+        """
+        self.report_errors()
+        self.count = self.count + 1
+        tempfile = '%s.tmp%d-%d' % (cachefile, os.getpid(), self.count)
+        self.queue.put((func, args, cachefile, tempfile, errmsg))
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                func, args, cachefile, tempfile, errmsg = item
+                try:
+                    if not os.path.exists(cachefile):
+                        func(*(args + (cachefile, tempfile)))
+                except EnvironmentError:
+                    self.errors.append(errmsg)
+                except Exception as e:
+                    self.errors.append("%s (%s)" % (errmsg, e))
+            finally:
+                self.queue.task_done()
+
+    def report_errors(self):
+        while self.errors:
+            msg = self.errors.pop(0)
+            SCons.Warnings.warn(SCons.Warnings.CacheWriteErrorWarning, msg)
+
+    def join(self):
+        self.queue.join()
+        self.report_errors()
+
+_the_push_queue = None
+
+def _push_queue():
+    global _the_push_queue
+    if _the_push_queue is None:
+        _the_push_queue = PushQueue(push_threads, push_queue_size)
+    return _the_push_queue
+
+def wait_for_pushes():
+    """
+    Waits for all queued cache pushes to finish, and reports any that
+    failed.
+    """
+    if _the_push_queue is not None:
+        _the_push_queue.join()
+
 CachePush = SCons.Action.Action(CachePushFunc, None)
 
+# Bundles:  a cache whose config has "bundles": true stores the targets
+# of a multi-target builder (a yacc .c and .h, a SWIG wrapper and its
+# module, ...) as a single entry, a tar archive (gzipped if the cache
+# compresses) with one member per target, named by the target's
+# position.  Its key is a signature of all of the targets' signatures.
+# The whole set gets pushed in one rename and retrieved in one read, so
+# a build never ends up with some targets from the cache and the rest
+# missing because another build was pushing or trimming at the time.
+# The first target's retrieve_from_cache() does the work; the others
+# just pick up the result from _bundled.
+_bundled = set()
+
+def bundle_targets(node):
+    """
+    Returns the list of targets that are cached together with node, or
+    None if node is cached on its own.
+    """
+    executor = node.get_executor()
+    if executor is None:
+        return None
+    targets = executor.get_all_targets()
+    if len(targets) < 2:
+        return None
+    return targets
+
+def _extract_bundle(cachefile, targets):
+    """
+    Unpacks a bundle into the files of targets.  Raises ValueError if
+    the bundle doesn't hold exactly one file or symlink per target.
+    """
+    tar = tarfile.open(cachefile, 'r:*')
+    try:
+        i = 0
+        for member in tar:
+            if i >= len(targets) or member.name != str(i):
+                raise ValueError("bundle %s does not match its targets" % cachefile)
+            path = targets[i].get_internal_path()
+            if os.path.lexists(path):
+                os.unlink(path)
+            if member.issym():
+                os.symlink(member.linkname, path)
+            elif member.isfile():
+                src = tar.extractfile(member)
+                with open(path, 'wb') as f:
+                    shutil.copyfileobj(src, f, 1024*1024)
+                os.chmod(path, (member.mode & 0o777) | stat.S_IWRITE)
+            else:
+                raise ValueError("bundle %s does not match its targets" % cachefile)
+            i = i + 1
+        if i != len(targets):
+            raise ValueError("bundle %s does not match its targets" % cachefile)
+    finally:
+        tar.close()
+
+def CacheRetrieveBundleFunc(target, source, env):
+    # The bundle counts as a request (and a hit) for each of its targets,
+    # as it would if they were cached one by one.
+    t = ', '.join(map(str, target))
+    cd = env.get_CacheDir()
+    cd.requests += len(target)
+    cachedir, cachefile = cd.bundlepath(target)
+    if not cd.in_cache(cachefile):
+        cd.CacheDebug('CacheRetrieve(%s):  %s not in cache\n', t, cachefile)
+        return 1
+    cd.hits += len(target)
+    cd.CacheDebug('CacheRetrieve(%s):  retrieving bundle from %s\n', t, cachefile)
+    if SCons.Action.execute_actions:
+        try:
+            _extract_bundle(cachefile, target)
+        except (EnvironmentError, EOFError, ValueError, tarfile.TarError, zlib.error):
+            # A truncated, vanished or mismatched bundle is a miss for
+            # every target, so don't leave any of them behind.
+            for n in target:
+                try:
+                    os.unlink(n.get_internal_path())
+                except OSError:
+                    pass
+            cd.hits -= len(target)
+            cd.CacheDebug('CacheRetrieve(%s):  %s could not be extracted\n', t, cachefile)
+            return 1
+        try:
+            os.utime(cachefile, None)
+        except OSError:
+            pass
+    return 0
+
+def CacheRetrieveBundleString(target, source, env):
+    cd = env.get_CacheDir()
+    cachedir, cachefile = cd.bundlepath(target)
+    if cd.in_cache(cachefile):
+        return "Retrieved %s from cache" % ", ".join(
+            ["`%s'" % t.get_internal_path() for t in target])
+    return None
+
+CacheRetrieveBundle = SCons.Action.Action(CacheRetrieveBundleFunc,
+                                          CacheRetrieveBundleString)
+
+CacheRetrieveBundleSilent = SCons.Action.Action(CacheRetrieveBundleFunc, None)
+
+def CachePushBundleFunc(target, source, env):
+    if cache_readonly:
+        return
+
+    for t in target:
+        if t.nocache:
+            return
+    paths = [t.get_internal_path() for t in target]
+    for path in paths:
+        # Only a complete set of plain files and symlinks gets bundled.
+        if not (os.path.isfile(path) or os.path.islink(path)):
+            return
+    t = ', '.join(map(str, target))
+    fs = target[0].fs
+    cd = env.get_CacheDir()
+    cachedir, cachefile = cd.bundlepath(target)
+    if fs.exists(cachefile):
+        cd.record(cachefile)
+        cd.CacheDebug('CachePush(%s):  %s already exists in cache\n', t, cachefile)
+        return
+
+    cd.CacheDebug('CachePush(%s):  pushing bundle to %s\n', t, cachefile)
+
+    errmsg = "Unable to copy %s to cache. Cache file is %s" % (str(target), cachefile)
+
+    _make_cachedir(fs, cachedir, errmsg)
+
+    if push_threads > 0:
+        _push_queue().put(_push_bundle, (paths, cd), cachefile, errmsg)
+        return
+
+    tempfile = cachefile+'.tmp'+str(os.getpid())
+    try:
+        _push_bundle(paths, cd, cachefile, tempfile)
+    except EnvironmentError:
+        try:
+            os.unlink(tempfile)
+        except OSError:
+            pass
+        SCons.Warnings.warn(SCons.Warnings.CacheWriteErrorWarning, errmsg)
+
+def _push_bundle(paths, cd, cachefile, tempfile):
+    """
+    Writes the files at paths into the cache as the bundle cachefile, by
+    way of tempfile.  Like _push_file(), this is safe to call from the
+    cache push threads.
+    """
+    if cd.compression == 'gzip':
+        tar = tarfile.open(tempfile, 'w:gz', compresslevel=compress_level)
+    else:
+        tar = tarfile.open(tempfile, 'w')
+    try:
+        for i, path in enumerate(paths):
+            tar.add(path, arcname=str(i), recursive=False)
+    finally:
+        tar.close()
+    os.rename(tempfile, cachefile)
+    _pushed(cd, cachefile)
+
+CachePushBundle = SCons.Action.Action(CachePushBundleFunc, None)
+
+# Remote cache tiers:  a cache whose config has a "remote" URL sits in
+# front of a shared content-addressed store.  A local miss is looked up
+# in the remote store, and a hit is downloaded into the local cache
+# first (so it stays hot there) and retrieved from it as usual.  Entries
+# pushed into the local cache get uploaded too, unless the config sets
+# "remote_readonly".  Entries are stored remotely exactly as they are
+# stored locally, compressed or not, under their signature.
+#
+# The remote store is reached through a backend object, created by
+# looking up the URL's scheme in remote_backends, that has these methods:
+#   exists(key)       - return whether the store has the entry
+#   fetch(key, path)  - download the entry to path; return False if the
+#                       store doesn't have it
+#   store(key, path)  - upload the file at path as the entry
+# All three raise EnvironmentError when they fail.  They're called from job
+# and cache push threads, so they have to be thread safe.
+remote_timeout = 30
+
+try:
+    from urllib.request import Request, urlopen
+    from urllib.error import HTTPError
+except ImportError:
+    from urllib2 import Request, urlopen, HTTPError
+
+class _Request(Request):
+    def __init__(self, url, method, data=None, headers=None):
+        Request.__init__(self, url, data, headers or {})
+        self._method = method
+
+    def get_method(self):
+        return self._method
+
+class HTTPCacheBackend(object):
+    """
+    A remote store that speaks plain HTTP:  HEAD or GET <url>/<key> to
+    look up or fetch an entry (404 meaning it's not there) and PUT
+    <url>/<key> to store one.  The file's permission bits travel in an
+    X-SCons-Mode header (octal), so executables stay executable.
+    scons-cache-server.py is a minimal server for it.
+    """
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+
+    def exists(self, key):
+        try:
+            urlopen(_Request(self.url + '/' + key, 'HEAD'),
+                    timeout=remote_timeout).close()
+        except HTTPError as e:
+            if e.code == 404:
+                return False
+            raise IOError("HEAD %s/%s failed: %s" % (self.url, key, e))
+        return True
+
+    def fetch(self, key, path):
+        try:
+            response = urlopen(_Request(self.url + '/' + key, 'GET'),
+                               timeout=remote_timeout)
+        except HTTPError as e:
+            if e.code == 404:
+                return False
+            raise IOError("GET %s/%s failed: %s" % (self.url, key, e))
+        try:
+            with open(path, 'wb') as f:
+                shutil.copyfileobj(response, f, 1024*1024)
+            mode = response.info().get('X-SCons-Mode')
+        finally:
+            response.close()
+        if mode:
+            try:
+                os.chmod(path, int(mode, 8) & 0o777)
+            except ValueError:
+                pass
+        return True
+
+    def store(self, key, path):
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            mode = stat.S_IMODE(os.fstat(f.fileno()).st_mode)
+            request = _Request(self.url + '/' + key, 'PUT', f,
+                               {'Content-Length': str(size),
+                                'Content-Type': 'application/octet-stream',
+                                'X-SCons-Mode': '%o' % mode})
+            try:
+                urlopen(request, timeout=remote_timeout).close()
+            except HTTPError as e:
+                raise IOError("PUT %s/%s failed: %s" % (self.url, key, e))
+
+remote_backends = {
+    'http': HTTPCacheBackend,
+    'https': HTTPCacheBackend,
+}
+
+# Manifests:  looking an entry up costs a stat, two really, since the
+# "Retrieved ... from cache" message checks too, and on a network file
+# system every one of them is a round trip, even for the many targets
+# that aren't in the cache at all.  A cache whose config has
+# "manifest": true keeps a list of its entries' names, one per line, in
+# manifest_file.  Each build reads it once, the first time it looks
+# something up, and answers lookups of entries the list doesn't have
+# from memory; only the ones it does have get stat'ed.  Pushes append
+# their entries' names to it.  The list can get out of date both ways:
+# an entry it lists may since have been trimmed (the stat finds that
+# out), and an entry another build pushed after we read it is taken to
+# be a miss (the build then finds the entry when it goes to push its
+# own copy, and adds it to our list).  Trimming rewrites the file from
+# what it found in the cache, and a cache without a manifest file gets
+# one written from a scan the first time it's used.
+manifest_file = 'manifest'
+
+# Cache reports:  with cache_report set to a file name ('-' meaning
+# stdout), each cache lookup and push appends a JSON object to it, one
+# per line, with the target, its builder, the entry's key and the time
+# it took; a retrieve says whether it hit and how many bytes it read, a
+# push how many bytes it wrote and, if the target missed in this build,
+# how long building it took (from the miss to the push).  At the end of
+# the build, write_cache_report() adds a summary object per cache
+# directory.  The file is appended to, so a series of builds can be
+# looked at together.
+cache_report = None
+
+_report_lock = threading.Lock()
+_report_fp = None
+_report_totals = {}
+_miss_times = {}
+
+def _builder_name(node):
+    try:
+        return node.get_builder().get_name(node.get_build_env())
+    except AttributeError:
+        return None
+
+def _write_report(record):
+    global _report_fp
+    if _report_fp is None:
+        if cache_report == '-':
+            _report_fp = sys.stdout
+        else:
+            _report_fp = open(cache_report, 'a')
+    _report_fp.write(json.dumps(record, sort_keys=True) + '\n')
+
+def report_cache_event(cd, node, event, key, **values):
+    """
+    Writes a cache report record about node.  This is called from job
+    threads, so it only looks at the node's name and builder.
+    """
+    global cache_report
+    record = {
+        'event': event,
+        'cache': cd.path,
+        'target': str(node),
+        'builder': _builder_name(node),
+        'key': key,
+    }
+    record.update(values)
+    with _report_lock:
+        totals = _report_totals.setdefault(cd.path, {
+            'requests': 0, 'hits': 0, 'pushes': 0,
+            'bytes_retrieved': 0, 'bytes_pushed': 0,
+            'retrieve_seconds': 0.0, 'push_seconds': 0.0,
+            'build_seconds': 0.0,
+        })
+        if event == 'retrieve':
+            totals['requests'] += 1
+            if values['hit']:
+                totals['hits'] += 1
+            totals['bytes_retrieved'] += values['bytes']
+            totals['retrieve_seconds'] += values['seconds']
+        else:
+            totals['pushes'] += 1
+            totals['bytes_pushed'] += values['bytes']
+            totals['push_seconds'] += values['seconds']
+            if values.get('build_seconds'):
+                totals['build_seconds'] += values['build_seconds']
+        try:
+            _write_report(record)
+        except EnvironmentError as e:
+            # Stop trying, rather than warning about every target.
+            msg = "Unable to write cache report %s: %s" % (cache_report, e)
+            cache_report = None
+            SCons.Warnings.warn(SCons.Warnings.CacheWriteErrorWarning, msg)
+
+def write_cache_report():
+    """
+    Writes the summary records for this build to the cache report and
+    closes it.
+    """
+    global _report_fp
+    if cache_report is None:
+        return
+    with _report_lock:
+        now = time.time()
+        try:
+            for path in sorted(_report_totals.keys()):
+                record = {'event': 'summary', 'cache': path, 'time': now}
+                record.update(_report_totals[path])
+                record['misses'] = record['requests'] - record['hits']
+                _write_report(record)
+            if _report_fp is not None and _report_fp is not sys.stdout:
+                _report_fp.close()
+            elif _report_fp is not None:
+                _report_fp.flush()
+        except EnvironmentError as e:
+            msg = "Unable to write cache report %s: %s" % (cache_report, e)
+            SCons.Warnings.warn(SCons.Warnings.CacheWriteErrorWarning, msg)
+        _report_fp = None
+        _report_totals.clear()
+        _miss_times.clear()
+
+# Signature records:  a cache whose config has "signatures": true keeps,
+# for each target pushed into it, a record of what went into its cache
+# signature:  the csig of each source, explicit dependency and implicit
+# dependency, and the signature of the action, along with the entry's
+# key.  The records for a target live in one file per target path
+# (named after a hash of the path, with signatures_suffix, in the usual
+# prefix subdirectory, so trimming and re-prefixing handle them like
+# entries), holding the signature_records newest ones.  With
+# cache_explain set, a target that misses the cache has its own
+# breakdown compared with the closest recorded one, and the
+# differences get printed.
+cache_explain = False
+signatures_suffix = '.sigs'
+signature_records = 10
+
+_explain_lock = threading.Lock()
+
+def signature_breakdown(node):
+    """
+    Returns a dict of the parts that make up node's cache signature
+    (see File.get_cachedir_bsig()).
+    """
+    sources = set(node.sources)
+    depends = set(node.depends)
+    children = []
+    for child in node.children():
+        if child in sources:
+            kind = 'source'
+        elif child in depends:
+            kind = 'depends'
+        else:
+            kind = 'implicit'
+        children.append([kind, str(child), child.get_cachedir_csig()])
+    return {
+        'target': node.get_internal_path(),
+        'key': node.get_cachedir_bsig(),
+        'action': node.get_contents_sig(),
+        'command': SCons.Util.to_str(node.get_executor().get_contents()),
+        'children': children,
+        'time': time.time(),
+    }
+
+def _signature_diff(old, new):
+    """
+    Returns a list of lines describing how signature breakdown new
+    differs from old.
+    """
+    diffs = []
+    if old.get('action') != new['action']:
+        diffs.append("action signature changed: %s -> %s" %
+                     (old.get('action'), new['action']))
+        if old.get('command') != new['command']:
+            diffs.append("  was: %s" % old.get('command'))
+            diffs.append("  now: %s" % new['command'])
+    before = dict([(c[1], c) for c in old.get('children', [])])
+    after = dict([(c[1], c) for c in new['children']])
+    for name in sorted(set(before) | set(after)):
+        if name not in before:
+            diffs.append("new %s dependency %s" % (after[name][0], name))
+        elif name not in after:
+            diffs.append("%s dependency %s is gone" % (before[name][0], name))
+        elif before[name][2] != after[name][2]:
+            diffs.append("%s %s changed: %s -> %s" %
+                         (after[name][0], name, before[name][2], after[name][2]))
+    old_names = [c[1] for c in old.get('children', [])]
+    new_names = [c[1] for c in new['children']]
+    if not diffs and old_names != new_names:
+        # The signature is computed over the children in order.
+        diffs.append("dependencies are in a different order")
+    return diffs
+
 # Nasty hack to cut down to one warning for each cachedir path that needs
 # upgrading.
 warned = dict()
@@ -157,6 +964,16 @@ class CacheDir(object):
         self.current_cache_debug = None
         self.debugFP = None
         self.config = dict()
+        self.max_size = 0
+        self.max_age = 0
+        self.compression = 'none'
+        self.remote = None
+        self.remote_readonly = False
+        self.bundles = False
+        self.signatures = False
+        self.manifest = False
+        self._manifest = None
+        self._manifest_lock = threading.Lock()
         if path is None:
             return
 
@@ -165,6 +982,33 @@ class CacheDir(object):
         else:
             self._readconfig2(path)
 
+        self.max_size = _config_value(self.config.get('max_size'),
+                                      size_units, 'max_size')
+        self.max_age = _config_value(self.config.get('max_age'),
+                                     age_units, 'max_age')
+        if self.max_size or self.max_age:
+            trimmed_caches.setdefault(path, self)
+
+        self.compression = self.config.get('compression') or 'none'
+        if self.compression not in compression_types:
+            msg = "Invalid value for compression in cache configuration: %s" % repr(self.compression)
+            raise SCons.Errors.SConsEnvironmentError(msg)
+
+        remote = self.config.get('remote')
+        if remote:
+            scheme = remote.split(':', 1)[0].lower()
+            try:
+                backend = remote_backends[scheme]
+            except KeyError:
+                msg = "Unsupported remote cache URL in cache configuration: %s" % remote
+                raise SCons.Errors.SConsEnvironmentError(msg)
+            self.remote = backend(remote)
+            self.remote_readonly = bool(self.config.get('remote_readonly'))
+
+        self.bundles = _config_flag(self.config.get('bundles'))
+        self.manifest = _config_flag(self.config.get('manifest'))
+        self.signatures = _config_flag(self.config.get('signatures'))
+
 
     def _readconfig3(self, path):
         """
@@ -291,6 +1135,71 @@ class CacheDir(object):
     def is_readonly(self):
         return cache_readonly
 
+    def _manifest_names(self):
+        """
+        Returns the set of entry names in the manifest, reading it (or
+        creating it) on the first call.
+        """
+        with self._manifest_lock:
+            if self._manifest is None:
+                manifest = os.path.join(self.path, manifest_file)
+                try:
+                    with open(manifest) as f:
+                        names = set([line.strip() for line in f])
+                    names.discard('')
+                except EnvironmentError:
+                    names = self._entry_names()
+                    if not cache_readonly:
+                        self._write_manifest(names)
+                self._manifest = names
+            return self._manifest
+
+    def _write_manifest(self, names):
+        manifest = os.path.join(self.path, manifest_file)
+        tempfile = manifest + '.tmp' + str(os.getpid())
+        try:
+            with open(tempfile, 'w') as f:
+                for name in sorted(names):
+                    f.write(name + '\n')
+            os.rename(tempfile, manifest)
+        except EnvironmentError:
+            try:
+                os.unlink(tempfile)
+            except OSError:
+                pass
+
+    def in_cache(self, cachefile):
+        """
+        Returns whether the entry cachefile is in the cache.  With a
+        manifest, entries it doesn't list are taken not to be, without
+        looking.
+        """
+        if self.manifest and \
+           os.path.basename(cachefile) not in self._manifest_names():
+            return False
+        return os.path.exists(cachefile)
+
+    def record(self, cachefile):
+        """
+        Adds the entry cachefile to the manifest, if the cache has one.
+        This is called from cache push threads too.
+        """
+        if not self.manifest:
+            return
+        name = os.path.basename(cachefile)
+        names = self._manifest_names()
+        with self._manifest_lock:
+            if name in names:
+                return
+            names.add(name)
+            # Lines this short get appended in one piece, even with
+            # several builds appending at once.
+            try:
+                with open(os.path.join(self.path, manifest_file), 'a') as f:
+                    f.write(name + '\n')
+            except EnvironmentError:
+                pass
+
     def cachepath(self, node):
         """
         """
@@ -304,6 +1213,22 @@ class CacheDir(object):
         dir = os.path.join(self.path, subdir)
         return dir, os.path.join(dir, sig)
 
+    def bundlepath(self, targets):
+        """
+        Returns the directory and file name of the bundle holding all of
+        targets, like cachepath() does for a single node.
+        """
+        if not self.is_enabled():
+            return None, None
+
+        sigs = [t.get_cachedir_bsig() for t in targets]
+        sig = SCons.Util.MD5signature('bundle ' + ' '.join(sigs))
+
+        subdir = sig[:self.config['prefix_len']].upper()
+
+        dir = os.path.join(self.path, subdir)
+        return dir, os.path.join(dir, sig)
+
     def retrieve(self, node):
         """
         This method is called from multiple threads in a parallel build,
@@ -332,6 +1257,27 @@ class CacheDir(object):
         if not self.is_enabled():
             return False
 
+        start = time.time()
+        hit = self._retrieve(node)
+        if cache_report is not None:
+            self._report_retrieve(node, hit, time.time() - start)
+        if SCons.Timeline.trace_file is not None:
+            SCons.Timeline.span('cache retrieve', 'cache', start,
+                                {'node' : str(node), 'hit' : bool(hit)})
+        if cache_explain and not hit:
+            self.explain_miss(node)
+        return hit
+
+    def _retrieve(self, node):
+        if self.bundles:
+            targets = bundle_targets(node)
+            if targets is not None:
+                return self.retrieve_bundle(node, targets)
+
+        if self.remote is not None and SCons.Action.execute_actions and \
+           not cache_readonly:
+            self.fetch_remote(node)
+
         env = node.get_build_env()
         if cache_show:
             if CacheRetrieveSilent(node, [], env, execute=1) == 0:
@@ -343,15 +1289,449 @@ class CacheDir(object):
 
         return False
 
+    def retrieve_bundle(self, node, targets):
+        """
+        Retrieves all of targets from their bundle when asked for the
+        first of them, and reports whether that worked when asked for
+        the others.
+        """
+        if node is not targets[0]:
+            try:
+                _bundled.remove(node)
+            except KeyError:
+                return False
+            if cache_show:
+                node.build(presub=0, execute=0)
+            return True
+
+        if self.remote is not None and SCons.Action.execute_actions and \
+           not cache_readonly:
+            self.fetch_remote(node, self.bundlepath(targets))
+
+        env = node.get_build_env()
+        if cache_show:
+            if CacheRetrieveBundleSilent(targets, [], env, execute=1) == 0:
+                node.build(presub=0, execute=0)
+            else:
+                return False
+        elif CacheRetrieveBundle(targets, [], env, execute=1) != 0:
+            return False
+        _bundled.update(targets[1:])
+        return True
+
+    def fetch_remote(self, node, path=None):
+        """
+        Copies node's entry (or, if path is given, the entry with that
+        (cachedir, cachefile) path) from the remote store into the local
+        cache, if the local cache doesn't have it already.  Like
+        retrieve(), this runs in job threads.
+
+        If the remote store can't be reached (as opposed to not having
+        the entry), it's given up on for the rest of the build, with
+        a warning, rather than slowing down every single target.
+        """
+        if path is None:
+            path = self.cachepath(node)
+        cachedir, cachefile = path
+        if os.path.exists(cachefile):
+            # Stat'ing is cheap next to asking the remote store, and it
+            # catches entries the manifest doesn't know about yet.
+            self.record(cachefile)
+            return
+        tempfile = '%s.tmp%d-%s' % (cachefile, os.getpid(),
+                                    threading.current_thread().ident)
+        try:
+            if not os.path.isdir(cachedir):
+                try:
+                    os.makedirs(cachedir)
+                except OSError:
+                    if not os.path.isdir(cachedir):
+                        raise
+            if not self.remote.fetch(os.path.basename(cachefile), tempfile):
+                self.CacheDebug('CacheRetrieve(%s):  %s not in remote cache\n', node, cachefile)
+                return
+            os.rename(tempfile, cachefile)
+        except EnvironmentError as e:
+            try:
+                os.unlink(tempfile)
+            except OSError:
+                pass
+            remote, self.remote = self.remote, None
+            if remote is not None:
+                msg = "Not using remote cache %s for the rest of this build: %s" % (self.config.get('remote'), e)
+                SCons.Warnings.warn(SCons.Warnings.CacheRemoteWarning, msg)
+            return
+        size = os.lstat(cachefile).st_size
+        with _pushed_bytes_lock:
+            pushed_bytes[self.path] = pushed_bytes.get(self.path, 0) + size
+        self.record(cachefile)
+        self.CacheDebug('CacheRetrieve(%s):  fetched %s from remote cache\n', node, cachefile)
+
     def push(self, node):
         if self.is_readonly() or not self.is_enabled():
             return
+        if cache_report is None:
+            start = SCons.Timeline.now()
+            result = self._push(node)
+            if start is not None:
+                SCons.Timeline.span('cache push', 'cache', start,
+                                    {'node' : str(node)})
+        else:
+            targets, cachefile = self._entry(node)
+            existed = os.path.exists(cachefile)
+            start = time.time()
+            result = self._push(node)
+            self._report_push(node, targets, cachefile, existed,
+                              time.time() - start)
+        if self.signatures:
+            self._record_signatures(node)
+        return result
+
+    def _push(self, node):
+        if self.bundles:
+            targets = bundle_targets(node)
+            if targets is not None:
+                # The bundle goes in with the first target.
+                if node is targets[0]:
+                    return CachePushBundle(targets, [], node.get_build_env())
+                return
         return CachePush(node, [], node.get_build_env())
 
     def push_if_forced(self, node):
         if cache_force:
             return self.push(node)
 
+    def _signatures_file(self, node):
+        name = SCons.Util.MD5signature('signatures ' + node.get_internal_path())
+        return os.path.join(self.path, name[:self.config['prefix_len']].upper(),
+                            name + signatures_suffix)
+
+    def _read_signatures(self, node):
+        records = []
+        try:
+            with open(self._signatures_file(node)) as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        # A torn line from a concurrent append.
+                        pass
+        except EnvironmentError:
+            pass
+        return records
+
+    def _record_signatures(self, node):
+        """
+        Adds the signature breakdowns of the targets in node's cache
+        entry to their signature files.
+        """
+        targets, cachefile = self._entry(node)
+        if node is not targets[0] or [t for t in targets if t.nocache]:
+            return
+        entry = os.path.basename(cachefile)
+        for t in targets:
+            record = signature_breakdown(t)
+            record['entry'] = entry
+            records = self._read_signatures(t)
+            if [r for r in records if r.get('key') == record['key']]:
+                continue
+            path = self._signatures_file(t)
+            try:
+                dir = os.path.dirname(path)
+                if not os.path.isdir(dir):
+                    try:
+                        os.makedirs(dir)
+                    except OSError:
+                        if not os.path.isdir(dir):
+                            raise
+                if len(records) >= signature_records:
+                    # Rewrite it with the newest ones.
+                    records = records[1 - signature_records:] + [record]
+                    tempfile = path + '.tmp' + str(os.getpid())
+                    with open(tempfile, 'w') as f:
+                        for r in records:
+                            f.write(json.dumps(r, sort_keys=True) + '\n')
+                    os.rename(tempfile, path)
+                else:
+                    with open(path, 'a') as f:
+                        f.write(json.dumps(record, sort_keys=True) + '\n')
+            except EnvironmentError:
+                pass
+
+    def explain_miss(self, node):
+        """
+        Prints why node missed the cache:  how its signature breakdown
+        differs from the closest one recorded for the same target whose
+        entry is still in the cache (or, failing that, whose entry was
+        in the cache once).  This runs in job threads.
+        """
+        mine = signature_breakdown(node)
+        records = [r for r in self._read_signatures(node)
+                   if r.get('key') != mine['key']]
+        lines = []
+        if not records:
+            lines.append("scons: %s is not in cache, and no other version of it has been cached with signatures.\n" % node)
+        else:
+            cached = [r for r in records
+                      if self.in_cache(self._entry_path(r.get('entry', '')))]
+            # Newest first, so ties go to the most recent entry.
+            candidates = list(reversed(cached or records))
+            diffs = [_signature_diff(r, mine) for r in candidates]
+            best = min(range(len(diffs)), key=lambda i: len(diffs[i]))
+            if cached:
+                lines.append("scons: %s is not in cache; compared to cached entry %s:\n" %
+                             (node, candidates[best].get('entry')))
+            else:
+                lines.append("scons: %s is not in cache; compared to entry %s, no longer cached:\n" %
+                             (node, candidates[best].get('entry')))
+            lines.extend(['    %s\n' % d for d in diffs[best]] or
+                         ['    no difference in the recorded signatures\n'])
+        with _explain_lock:
+            sys.stdout.write(''.join(lines))
+            sys.stdout.flush()
+
+    def _entry_path(self, entry):
+        return os.path.join(self.path, entry[:self.config['prefix_len']].upper(),
+                            entry)
+
+    def _entry(self, node):
+        """
+        Returns the targets whose files make up node's cache entry, and
+        the entry's path.
+        """
+        targets = None
+        if self.bundles:
+            targets = bundle_targets(node)
+        if targets is None:
+            return [node], self.cachepath(node)[1]
+        return targets, self.bundlepath(targets)[1]
+
+    def _report_retrieve(self, node, hit, seconds):
+        targets, cachefile = self._entry(node)
+        if node is not targets[0]:
+            # The first target of a bundle reports for all of them.
+            return
+        size = 0
+        if hit:
+            try:
+                size = os.lstat(cachefile).st_size
+            except OSError:
+                pass
+        if not hit:
+            now = time.time()
+            with _report_lock:
+                for t in targets:
+                    _miss_times[t] = now
+        key = os.path.basename(cachefile)
+        for t in targets:
+            report_cache_event(self, t, 'retrieve', key, hit=hit,
+                               bytes=size, seconds=seconds)
+            size = seconds = 0
+
+    def _report_push(self, node, targets, cachefile, existed, seconds):
+        now = time.time()
+        with _report_lock:
+            started = [_miss_times.pop(t, None) for t in targets]
+        if existed or node is not targets[0] or \
+           [t for t in targets if t.nocache] or \
+           (push_threads <= 0 and not os.path.exists(cachefile)):
+            # Nothing was pushed:  the entry was there already, or node
+            # is part of a bundle that goes in with the first target, or
+            # it's not to be cached, or the push failed.
+            return
+        build_seconds = None
+        if started[0] is not None:
+            build_seconds = now - seconds - started[0]
+        key = os.path.basename(cachefile)
+        for t in targets:
+            try:
+                size = os.lstat(t.get_internal_path()).st_size
+            except OSError:
+                size = 0
+            report_cache_event(self, t, 'push', key,
+                               bytes=size, seconds=seconds,
+                               build_seconds=build_seconds,
+                               queued=push_threads > 0)
+            # One task built and pushed the lot, so its times go with
+            # the first target.
+            seconds = 0
+            build_seconds = None
+
+    def _lock_trim(self):
+        """
+        Takes the trim lock for this cache directory.  Returns False if
+        some other build holds it.
+        """
+        lock = os.path.join(self.path, trim_lock_file)
+        for _ in range(2):
+            try:
+                fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except OSError:
+                try:
+                    if time.time() - os.stat(lock).st_mtime < stale_lock_age:
+                        return False
+                    os.unlink(lock)
+                except OSError:
+                    pass
+                continue
+            os.write(fd, str(os.getpid()).encode())
+            os.close(fd)
+            return True
+        return False
+
+    def _unlock_trim(self):
+        try:
+            os.unlink(os.path.join(self.path, trim_lock_file))
+        except OSError:
+            pass
+
+    def _read_trim_state(self):
+        try:
+            with open(os.path.join(self.path, trim_state_file)) as f:
+                state = json.load(f)
+            return int(state['size']), float(state['scanned'])
+        except (EnvironmentError, ValueError, KeyError, TypeError):
+            return None, 0
+
+    def _write_trim_state(self, size, scanned):
+        state_file = os.path.join(self.path, trim_state_file)
+        tempfile = state_file + '.tmp' + str(os.getpid())
+        try:
+            with open(tempfile, 'w') as f:
+                json.dump({'size': size, 'scanned': scanned}, f)
+            os.rename(tempfile, state_file)
+        except EnvironmentError:
+            pass
+
+    def _entry_names(self):
+        """
+        Returns the set of names of the entries in the cache.
+        """
+        names = set()
+        for subdir in os.listdir(self.path):
+            dir = os.path.join(self.path, subdir)
+            if not os.path.isdir(dir):
+                continue
+            for name in os.listdir(dir):
+                if '.tmp' not in name:
+                    names.add(name)
+        return names
+
+    def _scan(self):
+        """
+        Returns a list of (mtime, size, path) tuples for the entries in
+        the cache, after removing stale temporary files.
+        """
+        now = time.time()
+        entries = []
+        for subdir in os.listdir(self.path):
+            dir = os.path.join(self.path, subdir)
+            if not os.path.isdir(dir):
+                continue
+            for name in os.listdir(dir):
+                path = os.path.join(dir, name)
+                try:
+                    st = os.lstat(path)
+                except OSError:
+                    continue
+                if '.tmp' in name:
+                    if now - st.st_mtime > stale_tmp_age:
+                        try:
+                            os.unlink(path)
+                        except OSError:
+                            pass
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def trim(self, force=False):
+        """
+        Removes least recently used entries so the cache stays within
+        its configured max_size, and entries older than its max_age.
+
+        Unless force is set, the cache is only scanned when the size
+        estimate says it's over the limit or the last scan is old.
+        Entries are removed with a plain unlink, so a build that is
+        copying one out at the time still gets the whole file (on
+        POSIX; elsewhere, CacheRetrieveFunc treats the failed copy as
+        a miss).  Returns the number of bytes removed.
+        """
+        if cache_readonly or not self.is_enabled() or \
+           not (self.max_size or self.max_age):
+            return 0
+        if not self._lock_trim():
+            return 0
+        try:
+            size, scanned = self._read_trim_state()
+            now = time.time()
+            if size is not None and not force:
+                size = size + pushed_bytes.get(self.path, 0)
+                if (not self.max_size or size <= self.max_size) and \
+                   now - scanned < trim_scan_interval:
+                    self._write_trim_state(size, scanned)
+                    pushed_bytes[self.path] = 0
+                    return 0
+
+            manifest = os.path.join(self.path, manifest_file)
+            try:
+                manifest_size = os.path.getsize(manifest)
+            except OSError:
+                manifest_size = None
+            entries = self._scan()
+            entries.sort()
+            total = sum(e[1] for e in entries)
+            removed = 0
+            removed_paths = set()
+            if self.max_size and total > self.max_size:
+                target = int(self.max_size * trim_low_water)
+            else:
+                target = None
+            for mtime, esize, path in entries:
+                expired = self.max_age and now - mtime > self.max_age
+                if not expired and (target is None or total <= target):
+                    break
+                try:
+                    # Skip entries that got used since we looked.
+                    if os.lstat(path).st_mtime != mtime:
+                        continue
+                    os.unlink(path)
+                except OSError:
+                    continue
+                total = total - esize
+                removed = removed + esize
+                removed_paths.add(path)
+            if self.manifest and manifest_size is not None:
+                names = set([os.path.basename(e[2]) for e in entries
+                             if e[2] not in removed_paths])
+                # Keep whatever got pushed while we were scanning.
+                try:
+                    with open(manifest) as f:
+                        f.seek(manifest_size)
+                        names.update([line.strip() for line in f])
+                except EnvironmentError:
+                    pass
+                names.discard('')
+                self._write_manifest(names)
+                if self._manifest is not None:
+                    with self._manifest_lock:
+                        self._manifest.difference_update(
+                            [os.path.basename(p) for p in removed_paths])
+            self._write_trim_state(total, now)
+            pushed_bytes[self.path] = 0
+            self.CacheDebug('CacheTrim(%s):  removed %s bytes\n',
+                            self.path, str(removed))
+            return removed
+        finally:
+            self._unlock_trim()
+
+
+def trim_caches():
+    """
+    Trims every size- or age-limited cache directory used by this build.
+    """
+    for cd in trimmed_caches.values():
+        cd.trim()
+
 # Local Variables:
 # tab-width:4
 # indent-tabs-mode:nil
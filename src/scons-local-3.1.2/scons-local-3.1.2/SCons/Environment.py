@@ -46,6 +46,7 @@ import SCons.Builder
 import SCons.Debug
 from SCons.Debug import logInstanceCreation
 import SCons.Defaults
+import SCons.Job
 from SCons.Errors import UserError, BuildError
 import SCons.Memoize
 import SCons.Node
@@ -2171,6 +2172,19 @@ class Base(SubstitutionEnvironment):
         nkw = self.subst_kw(kw)
         return SCons.Scanner.Base(*nargs, **nkw)
 
+    def ResourcePool(self, name, units):
+        """Limits the jobs using resource pool 'name' to 'units' units
+        at once.  A --resource-pool option for the same pool wins."""
+        SCons.Job.set_resource_pool(self.subst(name), int(units))
+
+    def Resources(self, targets, **units):
+        """Declares how many units of each resource pool the jobs that
+        build the given targets use, overriding $RESOURCES."""
+        tlist = self.arg2nodes(targets, self.fs.Entry)
+        for t in tlist:
+            t.attributes.resources = units
+        return tlist
+
     def SConsignFile(self, name=".sconsign", dbm_module=None):
         if name is not None:
             name = self.subst(name)
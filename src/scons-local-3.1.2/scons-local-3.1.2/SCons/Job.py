@@ -33,10 +33,15 @@ __revision__ = "src/engine/SCons/Job.py bee7caf9defd6e108fc2998a2520ddb36a967691
 
 import SCons.compat
 
+import errno
 import os
+import select
 import signal
+import stat
+import sys
 
 import SCons.Errors
+import SCons.Util
 
 # The default stack size (in kilobytes) of the threads used to execute
 # jobs in parallel.
@@ -51,6 +56,314 @@ default_stack_size = 256
 
 interrupt_msg = 'Build interrupted.'
 
+# Load limiting (-l):  with max_load above zero, a parallel build with
+# at least one job running doesn't start another while the system is
+# busier than max_load.  Where /proc/loadavg is available, "busy" is the
+# number of runnable threads in it (as GNU make does), which reacts in
+# about as long as a job takes to start rather than the minute the load
+# averages take to catch up; elsewhere it's the one-minute average.
+# Where /proc/pressure/memory is available, new jobs are also held back
+# while more than max_memory_pressure percent of the last ten seconds
+# were spent stalled waiting for memory, so memory-hungry jobs (big
+# links) don't push the machine into swapping.  While holding back,
+# the load is looked at again every load_check_interval seconds.
+max_load = 0
+max_memory_pressure = 10.0
+load_check_interval = 0.5
+
+def load_average():
+    """
+    Returns the system load that -l compares against, or None if
+    there's no way to find it out.
+    """
+    try:
+        with open('/proc/loadavg') as f:
+            fields = f.read().split()
+        # Don't count the thread that's reading the file.
+        return int(fields[3].split('/')[0]) - 1
+    except (EnvironmentError, IndexError, ValueError):
+        pass
+    try:
+        return os.getloadavg()[0]
+    except (AttributeError, OSError):
+        return None
+
+def memory_pressure():
+    """
+    Returns the percentage of the last ten seconds that some tasks spent
+    stalled waiting for memory, or None if the system doesn't say.
+    """
+    try:
+        with open('/proc/pressure/memory') as f:
+            for line in f:
+                fields = line.split()
+                if fields and fields[0] == 'some':
+                    for field in fields[1:]:
+                        if field.startswith('avg10='):
+                            return float(field[6:])
+    except (EnvironmentError, ValueError):
+        pass
+    return None
+
+def overloaded():
+    """
+    Returns whether the system is too busy to start another job.
+    """
+    if max_load <= 0:
+        return False
+    load = load_average()
+    if load is not None and load > max_load:
+        return True
+    if max_memory_pressure > 0:
+        pressure = memory_pressure()
+        if pressure is not None and pressure > max_memory_pressure:
+            return True
+    return False
+
+# GNU make jobserver support.  A jobserver is a pipe (or, since make 4.4,
+# a named fifo) holding one byte, a "token", for each job beyond the
+# first that the processes sharing it may run at once.  When SCons runs
+# under "make -jN" (or under another SCons), it finds the jobserver in
+# MAKEFLAGS and takes a token out of it for every job it runs beyond its
+# first, so the whole tree of builds stays within the top-level N.  The
+# jobserver is handed on to the commands SCons runs, so nested make,
+# ninja and scons invocations draw from the same budget.
+#
+# A parallel SCons that didn't inherit a jobserver only starts its own,
+# sized by -j, with serve_jobserver (the --jobserver option):  that puts
+# MAKEFLAGS in every command's environment, and a nested make that sees
+# it runs in parallel, which plain -j never used to do.
+#
+# Under an inherited jobserver without -j, the number of worker threads
+# is jobserver_max_jobs, or the number of CPUs if that is 0.  While
+# waiting for a token, the jobserver is polled every
+# jobserver_poll_interval seconds.
+use_jobserver = True
+serve_jobserver = False
+jobserver_max_jobs = 0
+jobserver_poll_interval = 0.05
+
+# The jobserver the running build uses, if any.
+jobserver = None
+
+# With parallel_checks, a parallel build has its worker threads run the
+# up-to-date checks of the tasks the Taskmaster hands out (and so the
+# content signatures of their sources), leaving only the walk of the
+# dependency graph to the main thread.  An incremental build with many
+# unchanged sources then hashes them on all the threads at once.
+parallel_checks = False
+
+# Resource pools:  on top of -j, a parallel build runs no more jobs at
+# once than fit into each pool's units.  A job's demand comes from its
+# target's Resources() declaration or else from the $RESOURCES
+# construction variable of its build environment (so it can be set per
+# environment, per Builder through its overrides, or per call), as a
+# dictionary of pool name to units, or a pool name or list of names
+# using one unit each.  Pools nobody created don't limit anything, and
+# a job asking for more than a whole pool gets the whole pool.
+resource_pools = {}
+_pool_overrides = set()
+
+def set_resource_pool(name, units, override=False):
+    """
+    Sets the size of a resource pool.  Sizes set with override (from the
+    command line) aren't changed by later calls without it (from
+    SConscript files).
+    """
+    if units < 1:
+        raise SCons.Errors.UserError("Resource pool `%s' needs at least "
+                                     "one unit, not %s" % (name, units))
+    if override:
+        _pool_overrides.add(name)
+    elif name in _pool_overrides:
+        return
+    resource_pools[name] = units
+
+def task_resources(task):
+    """
+    Returns the pool units the given task needs, as a dictionary,
+    leaving out pools that don't exist.
+    """
+    if not resource_pools:
+        return {}
+    node = task.targets[0]
+    demand = getattr(node.attributes, 'resources', None)
+    if demand is None:
+        if not node.has_builder():
+            return {}
+        demand = node.get_build_env().get('RESOURCES')
+    if not demand:
+        return {}
+    if SCons.Util.is_String(demand):
+        demand = {demand : 1}
+    elif SCons.Util.is_Sequence(demand):
+        demand = dict([(name, 1) for name in demand])
+    result = {}
+    for name, units in demand.items():
+        size = resource_pools.get(name)
+        if size is not None and units > 0:
+            result[name] = min(int(units), size)
+    return result
+
+class Jobserver(object):
+    """
+    A client of a GNU make jobserver.
+
+    Tokens are read through a non-blocking file description of our own
+    where possible, since setting O_NONBLOCK on the descriptor we share
+    with other processes would break the ones that expect it to block.
+    """
+
+    def __init__(self, rfd, wfd, makeflags, owned_fds=(), fifo=False):
+        self.rfd = rfd
+        self.wfd = wfd
+        self.makeflags = makeflags
+        self.owned_fds = list(owned_fds)
+        self.fifo = fifo
+        self.use_select = False
+        if fifo:
+            # Opened by name (and non-blocking) just for us.
+            self.reader = rfd
+            return
+        try:
+            self.reader = os.open('/proc/self/fd/%d' % rfd,
+                                  os.O_RDONLY | os.O_NONBLOCK)
+            self.owned_fds.append(self.reader)
+        except (OSError, AttributeError):
+            # Without a private description, look before we read.  If
+            # another process grabs the token in between, the read waits
+            # for the next one, which is still correct, just slower.
+            self.reader = rfd
+            self.use_select = True
+
+    def pass_fds(self):
+        """Returns the descriptors that child processes need to inherit."""
+        if self.fifo:
+            # Children open the fifo by name.
+            return ()
+        return (self.rfd, self.wfd)
+
+    def acquire(self):
+        """
+        Takes a token out of the jobserver, without waiting.  Returns the
+        token, or None if there isn't one to be had right now.
+        """
+        if self.use_select:
+            try:
+                ready = select.select([self.reader], [], [], 0)[0]
+            except (select.error, ValueError):
+                return None
+            if not ready:
+                return None
+        try:
+            token = os.read(self.reader, 1)
+        except OSError as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                raise
+            return None
+        return token or None
+
+    def release(self, token):
+        """Puts a token back into the jobserver."""
+        os.write(self.wfd, token)
+
+    def close(self):
+        for fd in self.owned_fds:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        self.owned_fds = []
+
+def _check_pipe(fd):
+    # make doesn't close the jobserver descriptors it advertises when it
+    # runs a rule without '+', it just doesn't pass them on; their numbers
+    # may since have been reused for any other file.  Only a pipe can be
+    # the jobserver (GNU make checks the same).
+    if not stat.S_ISFIFO(os.fstat(fd).st_mode):
+        raise ValueError("descriptor %d is not a pipe" % fd)
+
+def inherited_jobserver(makeflags=None):
+    """
+    Returns a Jobserver for the jobserver named in MAKEFLAGS, or None if
+    there isn't one or it can't be used.
+    """
+    if makeflags is None:
+        makeflags = os.environ.get('MAKEFLAGS', '')
+    auth = None
+    flags = []
+    for word in makeflags.split():
+        if word == '--':
+            break
+        if word.startswith('--jobserver-auth=') or \
+           word.startswith('--jobserver-fds='):
+            auth = word.split('=', 1)[1]
+            flags.append(word)
+        elif word.startswith('-j'):
+            flags.append(word)
+    if auth is None:
+        return None
+
+    try:
+        if auth.startswith('fifo:'):
+            path = auth[5:]
+            rfd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+            try:
+                _check_pipe(rfd)
+                wfd = os.open(path, os.O_WRONLY)
+            except Exception:
+                os.close(rfd)
+                raise
+            return Jobserver(rfd, wfd, ' '.join(flags), (rfd, wfd), fifo=True)
+        rfd, wfd = [int(fd) for fd in auth.split(',')]
+        _check_pipe(rfd)
+        _check_pipe(wfd)
+    except (OSError, ValueError) as e:
+        msg = "jobserver unavailable (%s): %s\n" % (auth, e) + \
+              "\tignoring MAKEFLAGS jobserver; mark the parent make rule with '+'."
+        SCons.Warnings.warn(SCons.Warnings.JobserverWarning, msg)
+        return None
+    return Jobserver(rfd, wfd, ' '.join(flags))
+
+def new_jobserver(num):
+    """
+    Starts a jobserver with tokens for num jobs (one of which is implied),
+    or returns None if pipes aren't available.
+    """
+    try:
+        rfd, wfd = os.pipe()
+    except (OSError, AttributeError):
+        return None
+    if num > 1:
+        os.write(wfd, b'+' * (num - 1))
+    makeflags = '-j%d --jobserver-auth=%d,%d' % (num, rfd, wfd)
+    return Jobserver(rfd, wfd, makeflags, (rfd, wfd))
+
+def default_jobserver_jobs():
+    if jobserver_max_jobs > 0:
+        return jobserver_max_jobs
+    try:
+        import multiprocessing
+        return max(multiprocessing.cpu_count(), 2)
+    except (ImportError, NotImplementedError):
+        return 2
+
+def child_jobserver(env):
+    """
+    Returns the environment and the descriptors to pass down to a child
+    process so it shares the build's jobserver.
+    """
+    js = jobserver
+    if js is None or env is None:
+        return env, ()
+    env = dict(env)
+    makeflags = env.get('MAKEFLAGS')
+    if makeflags:
+        env['MAKEFLAGS'] = makeflags + ' ' + js.makeflags
+    else:
+        env['MAKEFLAGS'] = ' ' + js.makeflags
+    return env, js.pass_fds()
+
 
 class InterruptState(object):
     def __init__(self):
@@ -83,13 +396,22 @@ class Jobs(object):
         """
 
         self.job = None
+        self.jobserver = None
+        if use_jobserver and sys.platform != 'win32':
+            self.jobserver = inherited_jobserver()
+            if self.jobserver is not None:
+                if num <= 1:
+                    num = default_jobserver_jobs()
+            elif num > 1 and serve_jobserver:
+                self.jobserver = new_jobserver(num)
         if num > 1:
             stack_size = explicit_stack_size
             if stack_size is None:
                 stack_size = default_stack_size
 
             try:
-                self.job = Parallel(taskmaster, num, stack_size)
+                self.job = Parallel(taskmaster, num, stack_size,
+                                    self.jobserver)
                 self.num_jobs = num
             except NameError:
                 pass
@@ -106,12 +428,17 @@ class Jobs(object):
         SIGTERM or SIGHUP). The execution of postfunc() is protected
         against keyboard interrupts and is guaranteed to run to
         completion."""
+        global jobserver
         self._setup_sig_handler()
+        jobserver = self.jobserver
         try:
             self.job.start()
         finally:
             postfunc()
             self._reset_sig_handler()
+            jobserver = None
+            if self.jobserver is not None:
+                self.jobserver.close()
 
     def were_interrupted(self):
         """Returns whether the jobs were interrupted by a signal."""
@@ -233,8 +560,9 @@ else:
         dequeues the task, executes it, and posts a tuple including the task
         and a boolean indicating whether the task executed successfully. """
 
-        def __init__(self, requestQueue, resultsQueue, interrupted):
-            threading.Thread.__init__(self)
+        def __init__(self, requestQueue, resultsQueue, interrupted,
+                     name=None):
+            threading.Thread.__init__(self, name=name)
             self.setDaemon(1)
             self.requestQueue = requestQueue
             self.resultsQueue = resultsQueue
@@ -264,6 +592,20 @@ else:
 
                 self.resultsQueue.put((task, ok))
 
+    class ReadyCheck(object):
+        """A job for a worker thread that runs the up-to-date check of a
+        task instead of executing it."""
+
+        def __init__(self, task):
+            self.task = task
+            self.targets = task.targets
+
+        def execute(self):
+            self.task.tm.ready_task(self.task, worker=True)
+
+        def exception_set(self, exception=None):
+            self.task.exception_set(exception)
+
     class ThreadPool(object):
         """This class is responsible for spawning and managing worker threads."""
 
@@ -292,7 +634,9 @@ else:
             # Create worker threads
             self.workers = []
             for _ in range(num):
-                worker = Worker(self.requestQueue, self.resultsQueue, interrupted)
+                name = 'worker %d' % (len(self.workers) + 1)
+                worker = Worker(self.requestQueue, self.resultsQueue,
+                                interrupted, name)
                 self.workers.append(worker)
 
             if 'prev_size' in locals():
@@ -302,9 +646,12 @@ else:
             """Put task into request queue."""
             self.requestQueue.put(task)
 
-        def get(self):
-            """Remove and return a result tuple from the results queue."""
-            return self.resultsQueue.get()
+        def get(self, timeout=None):
+            """Remove and return a result tuple from the results queue.
+
+            With a timeout, raises queue.Empty if no result arrives in
+            that many seconds."""
+            return self.resultsQueue.get(timeout=timeout)
 
         def preparation_failed(self, task):
             self.resultsQueue.put((task, False))
@@ -345,7 +692,7 @@ else:
         This class is thread safe.
         """
 
-        def __init__(self, taskmaster, num, stack_size):
+        def __init__(self, taskmaster, num, stack_size, jobserver=None):
             """Create a new parallel job given a taskmaster.
 
             The taskmaster's next_task() method should return the next
@@ -358,13 +705,65 @@ else:
             Note: calls to taskmaster are serialized, but calls to
             execute() on distinct tasks are not serialized, because
             that is the whole point of parallel jobs: they can execute
-            multiple tasks simultaneously. """
+            multiple tasks simultaneously.
+
+            If a jobserver is given, every job but the first needs a
+            token from it before it's started. """
 
             self.taskmaster = taskmaster
             self.interrupted = InterruptState()
             self.tp = ThreadPool(num, stack_size, self.interrupted)
 
             self.maxjobs = num
+            self.jobserver = jobserver
+            self.tokens = []
+
+            # Resource pool units in use, and prepared tasks waiting for
+            # units to free up, as (task, demand) pairs, oldest first.
+            self.pool_use = {}
+            self.deferred = []
+            self.demands = {}
+
+            # Tasks whose up-to-date checks have come back from the
+            # worker threads.
+            self.parallel_checks = parallel_checks
+            self.checked = []
+
+        def _fits(self, demand):
+            for name, units in demand.items():
+                if self.pool_use.get(name, 0) + units > resource_pools[name]:
+                    return False
+            return True
+
+        def _claim(self, task, demand, sign):
+            for name, units in demand.items():
+                self.pool_use[name] = self.pool_use.get(name, 0) + sign*units
+            if sign > 0:
+                self.demands[task] = demand
+            else:
+                self.demands.pop(task, None)
+
+        def _next_deferred(self):
+            """Takes the oldest waiting task that fits off the list."""
+            for i, (task, demand) in enumerate(self.deferred):
+                if self._fits(demand):
+                    del self.deferred[i]
+                    return task, demand
+            return None, None
+
+        def _drop_deferred(self):
+            """Fails the waiting tasks once the build has been stopped."""
+            tasks = [task for task, demand in self.deferred] + self.checked
+            self.deferred = []
+            self.checked = []
+            for task in tasks:
+                task.fail_stop()
+                task.postprocess()
+
+        def _release_tokens(self, jobs):
+            """Gives back the tokens that 'jobs' running jobs don't need."""
+            while len(self.tokens) > max(jobs - 1, 0):
+                self.jobserver.release(self.tokens.pop())
 
         def start(self):
             """Start the job. This will begin pulling tasks from the
@@ -372,39 +771,111 @@ else:
             more tasks. If a task fails to execute (i.e. execute() raises
             an exception), then the job will stop."""
 
+            try:
+                self._start()
+            finally:
+                if self.jobserver is not None:
+                    self._release_tokens(0)
+
+        def _start(self):
             jobs = 0
+            checks = 0
 
             while True:
+                if (self.deferred or self.checked) and \
+                   self.taskmaster.stopped():
+                    self._drop_deferred()
+
                 # Start up as many available tasks as we're
                 # allowed to.
-                while jobs < self.maxjobs:
-                    task = self.taskmaster.next_task()
-                    if task is None:
+                wait = None
+                while jobs + checks < self.maxjobs:
+                    if jobs and overloaded():
+                        wait = load_check_interval
                         break
 
-                    try:
-                        # prepare task for execution
-                        task.prepare()
-                    except:
-                        task.exception_set()
-                        task.failed()
-                        task.postprocess()
-                    else:
-                        if task.needs_execute():
-                            # dispatch task
-                            self.tp.put(task)
-                            jobs = jobs + 1
+                    if self.jobserver is not None and len(self.tokens) < jobs:
+                        token = self.jobserver.acquire()
+                        if token is None:
+                            wait = jobserver_poll_interval
+                            break
+                        self.tokens.append(token)
+
+                    task, demand = self._next_deferred()
+                    if task is None:
+                        if self.checked:
+                            task = self.checked.pop(0)
                         else:
+                            task = self.taskmaster.next_task(
+                                not self.parallel_checks)
+                            if task is None:
+                                break
+                            if self.parallel_checks and \
+                               task.exc_info()[0] is None:
+                                # Have a worker find out if it needs
+                                # executing; it comes back on
+                                # self.checked.
+                                self.tp.put(ReadyCheck(task))
+                                checks = checks + 1
+                                continue
+
+                        try:
+                            # prepare task for execution
+                            task.prepare()
+                        except:
+                            task.exception_set()
+                            task.failed()
+                            task.postprocess()
+                            continue
+                        if not task.needs_execute():
                             task.executed()
                             task.postprocess()
+                            continue
+                        demand = task_resources(task)
+                        if not self._fits(demand):
+                            # Hold it back, and see if something else
+                            # can run in the meantime.
+                            self.deferred.append((task, demand))
+                            continue
+
+                    # dispatch task
+                    self._claim(task, demand, 1)
+                    self.tp.put(task)
+                    jobs = jobs + 1
 
-                if not task and not jobs: break
+                if self.jobserver is not None:
+                    self._release_tokens(jobs)
+
+                if not task and not jobs and not checks and \
+                   not self.deferred and not self.checked: break
 
                 # Let any/all completed tasks finish up before we go
                 # back and put the next batch of tasks on the queue.
                 while True:
-                    task, ok = self.tp.get()
+                    if wait is not None:
+                        # Look at the load or the jobserver again in a
+                        # bit, even if no job finishes meanwhile.
+                        try:
+                            task, ok = self.tp.get(wait)
+                        except queue.Empty:
+                            break
+                    else:
+                        task, ok = self.tp.get()
+
+                    if isinstance(task, ReadyCheck):
+                        # Any exception is already recorded on the task
+                        # itself, to be raised when it's prepared.
+                        checks = checks - 1
+                        self.taskmaster.checked_task(task.task)
+                        self.checked.append(task.task)
+                        if self.tp.resultsQueue.empty():
+                            break
+                        continue
+
                     jobs = jobs - 1
+                    self._claim(task, self.demands.get(task, {}), -1)
+                    if self.jobserver is not None:
+                        self._release_tokens(jobs)
 
                     if ok:
                         task.executed()
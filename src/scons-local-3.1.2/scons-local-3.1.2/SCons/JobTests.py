@@ -0,0 +1,126 @@
+#
+# Copyright (c) 2001 - 2019 The SCons Foundation
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY
+# KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+__revision__ = "src/engine/SCons/JobTests.py bee7caf9defd6e108fc2998a2520ddb36a967691 2019-12-17 02:07:09 bdeegan"
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import SCons.Job
+import SCons.Warnings
+
+
+class InheritedJobserverTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.warnings = []
+        self.saved_enabled = SCons.Warnings._enabled[:]
+        self.saved_out = SCons.Warnings._warningOut
+        SCons.Warnings.enableWarningClass(SCons.Warnings.JobserverWarning)
+        SCons.Warnings._warningOut = self.warnings.append
+
+    def tearDown(self):
+        SCons.Warnings._enabled[:] = self.saved_enabled
+        SCons.Warnings._warningOut = self.saved_out
+        shutil.rmtree(self.tmpdir)
+
+    def file(self, name, contents):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'wb') as f:
+            f.write(contents)
+        return path
+
+    def test_pipe(self):
+        """Test using a jobserver passed as a pair of pipe descriptors"""
+        rfd, wfd = os.pipe()
+        try:
+            js = SCons.Job.inherited_jobserver(
+                '-j4 --jobserver-auth=%d,%d' % (rfd, wfd))
+            assert js is not None
+            assert js.pass_fds() == (rfd, wfd), js.pass_fds()
+            js.close()
+            assert self.warnings == [], self.warnings
+        finally:
+            os.close(rfd)
+            os.close(wfd)
+
+    def test_not_pipes(self):
+        """Test ignoring jobserver descriptors that aren't pipes"""
+        # What make leaves behind for a rule without '+': the advertised
+        # numbers now belong to unrelated files.
+        src = self.file('src', b'source contents')
+        dst = self.file('dst', b'destination contents')
+        rfd = os.open(src, os.O_RDONLY)
+        wfd = os.open(dst, os.O_WRONLY | os.O_APPEND)
+        try:
+            js = SCons.Job.inherited_jobserver(
+                '-j4 --jobserver-auth=%d,%d' % (rfd, wfd))
+            assert js is None, js
+            assert len(self.warnings) == 1, self.warnings
+            assert isinstance(self.warnings[0],
+                              SCons.Warnings.JobserverWarning)
+        finally:
+            os.close(rfd)
+            os.close(wfd)
+        with open(dst, 'rb') as f:
+            assert f.read() == b'destination contents'
+
+    def test_one_pipe(self):
+        """Test ignoring jobserver descriptors when only one is a pipe"""
+        rfd, wfd = os.pipe()
+        other = os.open(self.file('other', b''), os.O_WRONLY)
+        try:
+            js = SCons.Job.inherited_jobserver(
+                '-j4 --jobserver-auth=%d,%d' % (rfd, other))
+            assert js is None, js
+            assert len(self.warnings) == 1, self.warnings
+        finally:
+            os.close(rfd)
+            os.close(wfd)
+            os.close(other)
+
+    def test_fifo_not_fifo(self):
+        """Test ignoring a jobserver fifo that isn't a fifo"""
+        path = self.file('fifo', b'')
+        js = SCons.Job.inherited_jobserver(
+            '-j4 --jobserver-auth=fifo:%s' % path)
+        assert js is None, js
+        assert len(self.warnings) == 1, self.warnings
+
+    def test_no_jobserver(self):
+        """Test MAKEFLAGS without a jobserver"""
+        assert SCons.Job.inherited_jobserver('-j4 -k') is None
+        assert self.warnings == [], self.warnings
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+# Local Variables:
+# tab-width:4
+# indent-tabs-mode:nil
+# End:
+# vim: set expandtab tabstop=4 shiftwidth=4:
@@ -53,6 +53,7 @@ import SCons.Memoize
 import SCons.Node
 import SCons.Node.Alias
 import SCons.Subst
+import SCons.Timeline
 import SCons.Util
 import SCons.Warnings
 
@@ -71,7 +72,9 @@ def sconsign_dir(node):
     creating it first if necessary."""
     if not node._sconsign:
         import SCons.SConsign
-        node._sconsign = SCons.SConsign.ForDirectory(node)
+        with SCons.SConsign.lock:
+            if not node._sconsign:
+                node._sconsign = SCons.SConsign.ForDirectory(node)
     return node._sconsign
 
 _sconsign_map = {0 : sconsign_none,
@@ -2912,6 +2915,30 @@ class File(Base):
         try: return binfo.bimplicit
         except AttributeError: return None
 
+    def get_stored_duration(self):
+        return getattr(self.get_stored_info(), 'duration', None)
+
+    def store_duration(self, duration):
+        self.get_stored_info().duration = duration
+
+    def get_stored_failed(self):
+        return getattr(self.get_stored_info(), 'failed', False)
+
+    def store_failed(self, failed):
+        if not self.store_info:
+            return
+        entry = self.get_stored_info()
+        if failed:
+            entry.failed = True
+        else:
+            try:
+                del entry.failed
+            except AttributeError:
+                pass
+        # A failed build doesn't store the Node's info, so the entry has
+        # to be put back in the .sconsign file explicitly.
+        self.dir.sconsign().set_entry(self.name, entry)
+
     def rel_path(self, other):
         return self.dir.rel_path(other)
 
@@ -3208,6 +3235,7 @@ class File(Base):
 
         csig = self.get_max_drift_csig()
         if csig is None:
+            start = SCons.Timeline.now()
 
             try:
                 if self.get_size() < SCons.Node.FS.File.md5_chunksize:
@@ -3224,6 +3252,10 @@ class File(Base):
                 if not csig:
                     csig = SCons.Util.MD5signature(contents)
 
+            if start is not None:
+                SCons.Timeline.span('signature', 'signature', start,
+                                    {'node' : str(self)})
+
         ninfo.csig = csig
 
         return csig
@@ -3773,6 +3805,103 @@ class FileFinder(object):
 find_file = FileFinder().find_file
 
 
+def _prehash_candidates(targets):
+    """
+    Returns the source Files the given targets depend on whose content
+    signatures will have to be computed from their contents.
+
+    This walk doesn't scan anything.  It follows the explicit children
+    of each Node, the entries of Dirs, and the implicit dependencies
+    that the last build recorded for each derived File.
+    """
+    seen = set()
+    stack = list(targets)
+    result = []
+    while stack:
+        node = stack.pop()
+        if node in seen:
+            continue
+        seen.add(node)
+        try:
+            node = node.disambiguate()
+        except (EnvironmentError, SCons.Errors.UserError):
+            continue
+        if isinstance(node, File) and not node.has_builder():
+            if hasattr(node.get_ninfo(), 'csig') or not node.rexists():
+                continue
+            if node.get_max_drift_csig() is not None:
+                continue
+            result.append(node)
+        elif isinstance(node, Dir):
+            for name, entry in node.entries.items():
+                if name not in ('.', '..'):
+                    stack.append(entry)
+        else:
+            stack.extend(node.children(scan=0))
+            if isinstance(node, File):
+                implicit = node.get_stored_implicit()
+                if implicit:
+                    stack.extend(implicit)
+    return result
+
+def prehash_sources(targets, threads):
+    """
+    Computes the content signatures of the source files that the given
+    targets depend on, on 'threads' threads at once, before the build
+    walks the dependency graph and would hash them one at a time.
+
+    Files whose signatures can be taken from the .sconsign file (see
+    File.get_max_drift_csig()) are left alone, as are files that can't
+    be read; the build deals with those as it always has.  Returns the
+    number of files hashed.
+    """
+    import threading
+    try:
+        import queue
+    except ImportError:
+        import Queue as queue
+
+    files = _prehash_candidates(targets)
+    if not files:
+        return 0
+
+    chunksize = File.md5_chunksize * 1024
+    work = queue.Queue()
+    for node in files:
+        work.put((node, node.rfile().get_abspath()))
+    results = []
+
+    def hash_files():
+        while True:
+            try:
+                node, path = work.get_nowait()
+            except queue.Empty:
+                return
+            start = SCons.Timeline.now()
+            try:
+                csig = SCons.Util.MD5filesignature(path, chunksize=chunksize)
+            except EnvironmentError:
+                continue
+            if start is not None:
+                SCons.Timeline.span('signature', 'signature', start,
+                                    {'node' : str(node)})
+            results.append((node, csig))
+
+    workers = []
+    for _ in range(max(1, min(threads, len(files)))):
+        t = threading.Thread(target=hash_files,
+                             name='prehash %d' % (len(workers) + 1))
+        t.daemon = True
+        t.start()
+        workers.append(t)
+    for t in workers:
+        t.join()
+
+    for node, csig in results:
+        node.get_ninfo().csig = csig
+    return len(results)
+
+
 def invalidate_node_memos(targets):
     """
     Invalidate the memoized values of all Nodes (files or directories)
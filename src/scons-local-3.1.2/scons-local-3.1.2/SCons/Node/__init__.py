@@ -59,6 +59,7 @@ import SCons.Debug
 from SCons.Debug import logInstanceCreation
 import SCons.Executor
 import SCons.Memoize
+import SCons.Timeline
 import SCons.Util
 
 from SCons.Debug import Trace
@@ -1093,6 +1094,8 @@ class Node(object, with_metaclass(NoSlotsPyPy)):
                     tgt.implicit = []
                     tgt.implicit_set = set()
 
+        start = SCons.Timeline.now()
+
         # Have the executor scan the sources.
         executor.scan_sources(self.builder.source_scanner)
 
@@ -1102,6 +1105,9 @@ class Node(object, with_metaclass(NoSlotsPyPy)):
         if scanner:
             executor.scan_targets(scanner)
 
+        if start is not None:
+            SCons.Timeline.span('scan', 'scan', start, {'node' : str(self)})
+
     def scanner_key(self):
         return None
 
@@ -1218,6 +1224,22 @@ class Node(object, with_metaclass(NoSlotsPyPy)):
         """Fetch the stored implicit dependencies"""
         return None
 
+    def get_stored_duration(self):
+        """Fetch how long the last build of this Node took, in seconds"""
+        return None
+
+    def store_duration(self, duration):
+        """Record how long building this Node took, in seconds"""
+        pass
+
+    def get_stored_failed(self):
+        """Fetch whether the last attempt to build this Node failed"""
+        return False
+
+    def store_failed(self, failed):
+        """Record whether the attempt to build this Node failed"""
+        pass
+
     #
     #
     #
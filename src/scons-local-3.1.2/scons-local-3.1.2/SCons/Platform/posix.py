@@ -33,12 +33,14 @@ selection method.
 __revision__ = "src/engine/SCons/Platform/posix.py bee7caf9defd6e108fc2998a2520ddb36a967691 2019-12-17 02:07:09 bdeegan"
 
 import errno
+import fcntl
 import os
 import os.path
 import subprocess
 import sys
 import select
 
+import SCons.Job
 import SCons.Util
 from SCons.Platform import TempFileMunge
 from SCons.Platform.virtualenv import ImportVirtualenv
@@ -62,17 +64,51 @@ def escape(arg):
     return '"' + arg + '"'
 
 
+def _inherit_only(fds):
+    # Python 2's Popen can't pass some descriptors down and close the rest
+    # (there's no pass_fds, and close_fds closes them before preexec_fn
+    # runs), so with close_fds off, the child marks every other descriptor
+    # close-on-exec itself.
+    def preexec():
+        try:
+            open_fds = [int(fd) for fd in os.listdir('/dev/fd')]
+        except (OSError, ValueError):
+            try:
+                open_fds = range(3, os.sysconf('SC_OPEN_MAX'))
+            except (AttributeError, ValueError, OSError):
+                open_fds = range(3, 256)
+        for fd in open_fds:
+            if fd < 3 or fd in fds:
+                continue
+            try:
+                flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+                fcntl.fcntl(fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+            except (IOError, OSError):
+                pass
+    return preexec
+
+def _jobserver_kw(env):
+    # Hand the build's jobserver, if any, down to the child.
+    env, fds = SCons.Job.child_jobserver(env)
+    kw = {'env' : env, 'close_fds' : True}
+    if fds:
+        if sys.version_info[0] >= 3:
+            kw['pass_fds'] = fds
+        else:
+            kw['close_fds'] = False
+            kw['preexec_fn'] = _inherit_only(fds)
+    return kw
+
 def exec_subprocess(l, env):
-    proc = subprocess.Popen(l, env = env, close_fds = True)
+    proc = subprocess.Popen(l, **_jobserver_kw(env))
     return proc.wait()
 
 def subprocess_spawn(sh, escape, cmd, args, env):
     return exec_subprocess([sh, '-c', ' '.join(args)], env)
 
 def exec_popen3(l, env, stdout, stderr):
-    proc = subprocess.Popen(l, env = env, close_fds = True,
-                            stdout = stdout,
-                            stderr = stderr)
+    proc = subprocess.Popen(l, stdout = stdout, stderr = stderr,
+                            **_jobserver_kw(env))
     return proc.wait()
 
 def piped_env_spawn(sh, escape, cmd, args, env, stdout, stderr):
@@ -35,8 +35,12 @@ import SCons.compat
 
 import os
 import pickle
+import threading
+import time
 
 import SCons.dblite
+import SCons.SConsignCodec
+import SCons.Timeline
 import SCons.Warnings
 
 from SCons.compat import PICKLE_PROTOCOL
@@ -63,8 +67,33 @@ DB_Module = SCons.dblite
 DB_Name = ".sconsign"
 DB_sync_list = []
 
+# How directory entries are serialized when they are written:  "pickle"
+# (readable by any version of SCons) or "binary" (the more compact
+# SCons.SConsignCodec encoding).  Either one is understood when reading.
+sconsign_formats = ('pickle', 'binary')
+sconsign_format = 'pickle'
+
+# Checkpointing:  while a build is running, the signature information
+# gathered so far gets written out every "checkpoint_interval" seconds
+# and/or every "checkpoint_tasks" built tasks, so an interrupted build
+# doesn't lose it.  Zero disables either trigger.
+checkpoint_interval = 0
+checkpoint_tasks = 0
+_tasks_since_checkpoint = 0
+_last_checkpoint = None
+
+
+# Held while the database and the per-directory signature objects get
+# created.  The up-to-date checks that --parallel-checks runs on worker
+# threads can be the first to ask for a directory's signatures, and two
+# threads creating the same ones would each write their own copy back.
+lock = threading.RLock()
 
 def Get_DataBase(dir):
+    with lock:
+        return _get_database(dir)
+
+def _get_database(dir):
     global DataBase, DB_Module, DB_Name
     top = dir.fs.Top
     if not os.path.isabs(DB_Name) and top.repositories:
@@ -97,15 +126,90 @@ def Get_DataBase(dir):
 def Reset():
     """Reset global state.  Used by unit tests that end up using
     SConsign multiple times to get a clean slate for each test."""
-    global sig_files, DB_sync_list
+    global sig_files, DB_sync_list, _tasks_since_checkpoint, _last_checkpoint
     sig_files = []
     DB_sync_list = []
+    _tasks_since_checkpoint = 0
+    _last_checkpoint = None
 
 normcase = os.path.normcase
 
 
+def encode_entries(entries, format=None):
+    """
+    Serializes a directory's dictionary of SConsignEntry objects in
+    the given format, by default the currently selected sconsign_format.
+    """
+    if format is None:
+        format = sconsign_format
+    if format == 'binary':
+        return SCons.SConsignCodec.encode(entries)
+    return SCons.SConsignCodec.encode_pickle(entries)
+
+
+def decode_entries(data):
+    """
+    Turns bytes written by encode_entries(), in either format, back
+    into a dictionary of SConsignEntry objects.
+    """
+    entries = SCons.SConsignCodec.decode(data)
+    if not isinstance(entries, dict):
+        raise TypeError("sconsign entries are not a dictionary")
+    return entries
+
+
+def checkpoint():
+    """
+    Writes out the signature information gathered so far, without
+    closing anything, so the build can carry on afterwards.
+
+    This only writes the entries of nodes that have already been built
+    (the ones recorded by store_info()).  The storage methods write to a
+    temporary file and rename it over the old one, so a build killed
+    during a checkpoint keeps the previous checkpoint's signatures.
+    """
+    global _tasks_since_checkpoint, _last_checkpoint
+    _tasks_since_checkpoint = 0
+    _last_checkpoint = time.time()
+    written = False
+    for sig_file in sig_files:
+        if sig_file.dirty:
+            sig_file.write(sync=0)
+            written = True
+    if not written:
+        return
+    for db in DB_sync_list:
+        try:
+            syncmethod = db.sync
+        except AttributeError:
+            pass # Not all dbm modules have sync() methods.
+        else:
+            syncmethod()
+
+
+def task_completed():
+    """
+    Called by the build loop (in the main thread, never by a job
+    worker) each time a task has finished building its targets;
+    checkpoints the signature information when one of the configured
+    thresholds is reached.
+    """
+    global _tasks_since_checkpoint, _last_checkpoint
+    if checkpoint_interval <= 0 and checkpoint_tasks <= 0:
+        return
+    _tasks_since_checkpoint = _tasks_since_checkpoint + 1
+    if _last_checkpoint is None:
+        _last_checkpoint = time.time()
+    if checkpoint_tasks > 0 and _tasks_since_checkpoint >= checkpoint_tasks:
+        checkpoint()
+    elif checkpoint_interval > 0 and \
+         time.time() - _last_checkpoint >= checkpoint_interval:
+        checkpoint()
+
+
 def write():
     global sig_files
+    start = SCons.Timeline.now()
     for sig_file in sig_files:
         sig_file.write(sync=0)
     for db in DB_sync_list:
@@ -121,6 +225,151 @@ def write():
             pass # Not all dbm modules have close() methods.
         else:
             closemethod()
+    if start is not None:
+        SCons.Timeline.span('write .sconsign', 'sconsign', start)
+
+
+def _known_entries(fs):
+    """
+    Returns a dictionary mapping the (normalized) internal path of every
+    directory Node the FS knows about to the set of (normalized) names
+    of the entries in it.
+    """
+    known = {}
+    seen = set()
+    stack = list(fs.Root.values())
+    while stack:
+        dir = stack.pop()
+        if id(dir) in seen:
+            continue
+        seen.add(id(dir))
+        names = known.setdefault(normcase(dir.get_internal_path()), set())
+        for name, node in dir.entries.items():
+            if name in ('.', '..'):
+                continue
+            names.add(normcase(name))
+            if getattr(node, 'entries', None) is not None:
+                stack.append(node)
+    return known
+
+
+def _referenced_entries(entry):
+    """
+    Yields (directory, name) pairs for the dependencies recorded in an
+    entry's build information, in the same normalized form as
+    _known_entries() uses.
+    """
+    binfo = getattr(entry, 'binfo', None)
+    for attr in ('bsources', 'bdepends', 'bimplicit'):
+        for path in getattr(binfo, attr, None) or ():
+            path = normcase(str(path))
+            dir, name = os.path.split(path)
+            if not dir:
+                dir = '.'
+            yield dir, name
+
+
+def collect_garbage(fs, dry_run=False):
+    """
+    Removes the signature entries that no longer belong to any Node.
+
+    An entry is kept if its file is known to the FS (that is, it was
+    mentioned by the SConscript files just read) or if a kept entry
+    lists it as a dependency--implicit dependencies such as header
+    files are only discovered by scanning during a build.  Directories
+    that end up with no entries at all are dropped entirely, which
+    takes care of variant directories that are no longer used.
+
+    Only the .sconsign database of the top-level directory is touched
+    (or, with per-directory .sconsign files, the files in directories
+    the FS knows about).  Returns a tuple of the number of entries
+    removed, the number of directories removed and the number of bytes
+    of encoded signature data reclaimed.
+    """
+    known = _known_entries(fs)
+
+    if ForDirectory is DB:
+        db, mode = Get_DataBase(fs.Top)
+        raw = dict((key, db[key]) for key in db.keys())
+    else:
+        db = None
+        raw = {}
+        for key in known:
+            try:
+                with open(os.path.join(key, '.sconsign'), 'rb') as f:
+                    raw[key] = f.read()
+            except (IOError, OSError):
+                pass
+
+    directories = {}
+    for key, data in raw.items():
+        try:
+            directories[key] = decode_entries(data)
+        except KeyboardInterrupt:
+            raise
+        except Exception as e:
+            SCons.Warnings.warn(SCons.Warnings.CorruptSConsignWarning,
+                                "Ignoring corrupt sconsign entry : %s (%s)\n" % (key, e))
+
+    # Start with the entries of known files, then keep adding the files
+    # they depend on until nothing new turns up.
+    keep = set()
+    pending = []
+    for key, entries in directories.items():
+        names = known.get(normcase(key), ())
+        for name in entries:
+            if normcase(name) in names:
+                pending.append((key, name))
+    lookup = {}
+    for key, entries in directories.items():
+        for name in entries:
+            lookup[(normcase(key), normcase(name))] = (key, name)
+    while pending:
+        item = pending.pop()
+        if item in keep:
+            continue
+        keep.add(item)
+        key, name = item
+        for ref in _referenced_entries(directories[key][name]):
+            try:
+                pending.append(lookup[ref])
+            except KeyError:
+                pass
+
+    removed_entries = removed_dirs = reclaimed = 0
+    for key, entries in directories.items():
+        unused = [name for name in entries if (key, name) not in keep]
+        if not unused:
+            continue
+        removed_entries = removed_entries + len(unused)
+        for name in unused:
+            del entries[name]
+        if entries:
+            if SCons.SConsignCodec.is_encoded(raw[key]):
+                data = encode_entries(entries, 'binary')
+            else:
+                data = encode_entries(entries, 'pickle')
+            reclaimed = reclaimed + len(raw[key]) - len(data)
+        else:
+            data = None
+            removed_dirs = removed_dirs + 1
+            reclaimed = reclaimed + len(raw[key]) + len(key)
+        if dry_run:
+            continue
+        if db is not None:
+            if data is None:
+                del db[key]
+            else:
+                db[key] = data
+        else:
+            path = os.path.join(key, '.sconsign')
+            if data is None:
+                os.unlink(path)
+            else:
+                with open(path, 'wb') as f:
+                    f.write(data)
+
+    return removed_entries, removed_dirs, reclaimed
 
 
 class SConsignEntry(object):
@@ -131,9 +380,15 @@ class SConsignEntry(object):
     XXX As coded below, we do expect a '.binfo' attribute to be added,
     but we'll probably generalize this in the next refactorings.
     """
-    __slots__ = ("binfo", "ninfo", "__weakref__")
+    __slots__ = ("binfo", "ninfo", "duration", "failed", "__weakref__")
     current_version_id = 2
 
+    # Slots that are left out of the pickled state, because a version of
+    # SCons whose entries don't have them can't unpickle an entry that
+    # has.  They're stored beside the entries instead (see
+    # SCons.SConsignCodec).
+    extra_fields = ("duration", "failed")
+
     def __init__(self):
         # Create an object attribute from the class attribute so it ends up
         # in the pickled data in the .sconsign file.
@@ -154,12 +409,23 @@ class SConsignEntry(object):
                     state[name] = getattr(self, name)
 
         state['_version_id'] = self.current_version_id
-        try:
-            del state['__weakref__']
-        except KeyError:
-            pass
+        for name in ('__weakref__',) + self.extra_fields:
+            try:
+                del state[name]
+            except KeyError:
+                pass
         return state
 
+    def get_extras(self):
+        """
+        Returns a dictionary of the extra_fields that are set.
+        """
+        extras = {}
+        for name in self.extra_fields:
+            if hasattr(self, name):
+                extras[name] = getattr(self, name)
+        return extras
+
     def __setstate__(self, state):
         for key, value in state.items():
             if key not in ('_version_id','__weakref__'):
@@ -244,10 +510,7 @@ class DB(Base):
             pass
         else:
             try:
-                self.entries = pickle.loads(rawentries)
-                if not isinstance(self.entries, dict):
-                    self.entries = {}
-                    raise TypeError
+                self.entries = decode_entries(rawentries)
             except KeyboardInterrupt:
                 raise
             except Exception as e:
@@ -282,7 +545,8 @@ class DB(Base):
         path = normcase(self.dir.get_internal_path())
         for key, entry in self.entries.items():
             entry.convert_to_sconsign()
-        db[path] = pickle.dumps(self.entries, PICKLE_PROTOCOL)
+        db[path] = encode_entries(self.entries)
+        self.dirty = False
 
         if sync:
             try:
@@ -304,10 +568,7 @@ class Dir(Base):
         if not fp:
             return
 
-        self.entries = pickle.load(fp)
-        if not isinstance(self.entries, dict):
-            self.entries = {}
-            raise TypeError
+        self.entries = decode_entries(fp.read())
 
         if dir:
             for key, entry in self.entries.items():
@@ -377,21 +638,18 @@ class DirFile(Dir):
                 return
         for key, entry in self.entries.items():
             entry.convert_to_sconsign()
-        pickle.dump(self.entries, file, PICKLE_PROTOCOL)
+        file.write(encode_entries(self.entries))
         file.close()
+        self.dirty = False
         if fname != self.sconsign:
             try:
                 mode = os.stat(self.sconsign)[0]
-                os.chmod(self.sconsign, 0o666)
-                os.unlink(self.sconsign)
             except (IOError, OSError):
-                # Try to carry on in the face of either OSError
-                # (things like permission issues) or IOError (disk
-                # or network issues).  If there's a really dangerous
-                # issue, it should get re-raised by the calls below.
-                pass
+                mode = 0o666
             try:
-                os.rename(fname, self.sconsign)
+                # Never leaves a moment without a .sconsign file, except
+                # on Windows without os.replace().
+                SCons.dblite.replace_file(fname, self.sconsign)
             except OSError:
                 # An OSError failure to rename may indicate something
                 # like the directory has no write permission, but
@@ -400,6 +658,10 @@ class DirFile(Dir):
                 # here, or in any of the following calls, would get
                 # raised, indicating something like a potentially
                 # serious disk or network issue.
+                try:
+                    os.chmod(self.sconsign, 0o666)
+                except OSError:
+                    pass
                 with open(self.sconsign, 'wb') as f, open(fname, 'rb') as f2:
                     f.write(f2.read())
                 os.chmod(self.sconsign, mode)
@@ -0,0 +1,467 @@
+"""SCons.SConsignCodec
+
+A compact binary encoding for the per-directory dictionaries of
+SConsignEntry objects that SCons.SConsign stores in .sconsign files.
+
+Pickling a directory's entries repeats every dependency path string once
+per entry that refers to it, and stores each content signature as a
+32-character hex string.  This codec writes a table of the distinct
+strings used in the directory once, refers to them by index, and stores
+the fields of each FileNodeInfo (csig, timestamp, size) in fixed-width
+binary form.
+
+Anything the codec does not know how to represent exactly--an entry with
+extra attributes, a signature of a node type other than File, a csig that
+isn't an MD5 hex digest--is pickled on its own and embedded as a blob, so
+encoding never loses information.
+
+The encoding is versioned by the header; decode() also accepts plain
+pickled dictionaries, which is what every .sconsign file written before
+this codec existed contains, and data written by earlier versions of
+the encoding.
+
+The pickle format (encode_pickle()) stays readable by older versions of
+SCons:  the SConsignEntry attributes they don't know about (its
+extra_fields) are pickled separately, as a dictionary mapping names to
+each entry's extras that follows the entries.  Unpickling only reads the
+first object, so older versions never see it.
+"""
+
+#
+# Copyright (c) 2001 - 2019 The SCons Foundation
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY
+# KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+__revision__ = "src/engine/SCons/SConsignCodec.py bee7caf9defd6e108fc2998a2520ddb36a967691 2019-12-17 02:07:09 bdeegan"
+
+import binascii
+import io
+import pickle
+import struct
+import sys
+
+from SCons.compat import PICKLE_PROTOCOL
+
+magic = b'SCsg'
+format_version = 2
+read_versions = (1, 2)
+
+_header = struct.Struct('<4sB')
+_uint = struct.Struct('<I')
+
+# A FileNodeInfo:  presence flags, 16-byte binary MD5 csig, timestamp, size.
+_ninfo = struct.Struct('<B16sqq')
+
+# Flags in the first byte of a FileNodeInfo record.
+_HAS_CSIG = 0x01
+_HAS_TIMESTAMP = 0x02
+_HAS_SIZE = 0x04
+_CSIG_IS_STRING = 0x08      # csig stored as a string-table index
+
+# Record tags.
+_TAG_BINARY = 0
+_TAG_PICKLE = 1
+
+_NONE = 0xffffffff          # string index meaning None
+
+# Bit in the build info presence byte for the bact attribute; the lower
+# bits flag the _binfo_lists and _binfo_sigs attributes, in order.
+_HAS_BACT = 0x40
+
+# Flags in the byte that follows the build info header (from version 2
+# on) for the optional attributes of the entry itself.  A set flag means
+# the value follows, in the order listed here.
+_HAS_DURATION = 0x01        # seconds, as a double
+_HAS_FAILED = 0x02          # the last build failed; no value follows
+
+_ninfo_fields = set(['csig', 'timestamp', 'size', '_version_id'])
+_binfo_lists = ('bsources', 'bdepends', 'bimplicit')
+_binfo_sigs = ('bsourcesigs', 'bdependsigs', 'bimplicitsigs')
+# dependency_map is a lookup cache that gets rebuilt on demand from the
+# lists above, so it is not worth storing.
+_binfo_fields = set(_binfo_lists + _binfo_sigs +
+                    ('bactsig', 'bact', 'dependency_map', '_version_id'))
+_entry_fields = set(['binfo', 'ninfo', '_version_id'])
+
+_int_types = (int,) if bytes is not str else (int, long)  # noqa: F821
+_str_types = (str,) if bytes is not str else (str, unicode)  # noqa: F821
+
+if bytes is str:
+    # Python 2: the string table holds native (byte) strings, which is
+    # what SCons uses for names and signatures there; intern() only takes
+    # those, not unicode.
+    def _encode_string(s):
+        if isinstance(s, str):
+            return s
+        return s.encode('utf-8')
+
+    def _decode_string(b):
+        return sys.intern(str(b))
+else:
+    def _encode_string(s):
+        return s.encode('utf-8')
+
+    def _decode_string(b):
+        return sys.intern(b.decode('utf-8'))
+
+
+class CodecError(ValueError):
+    pass
+
+
+def is_encoded(data):
+    """Returns whether data was written by this codec."""
+    return data[:len(magic)] == magic
+
+
+class _Encoder(object):
+    def __init__(self):
+        self.strings = []
+        self.string_index = {}
+        self.body = []
+
+    def string(self, s):
+        if s is None:
+            return _NONE
+        try:
+            return self.string_index[s]
+        except KeyError:
+            i = self.string_index[s] = len(self.strings)
+            self.strings.append(s)
+            return i
+
+    def pickled(self, obj):
+        data = pickle.dumps(obj, PICKLE_PROTOCOL)
+        self.body.append(_uint.pack(len(data)))
+        self.body.append(data)
+
+    def file_ninfo(self, ninfo):
+        """
+        Appends a FileNodeInfo record, or returns False if ninfo can't
+        be represented exactly (in which case nothing is appended).
+        """
+        state = ninfo.__getstate__()
+        if not _ninfo_fields.issuperset(state):
+            return False
+        flags = 0
+        csig = b'\0' * 16
+        timestamp = size = 0
+        if 'csig' in state:
+            value = state['csig']
+            if not isinstance(value, _str_types):
+                return False
+            flags = flags | _HAS_CSIG
+            if len(value) == 32:
+                try:
+                    csig = binascii.unhexlify(value)
+                except (TypeError, ValueError, binascii.Error):
+                    csig = None
+                if csig is not None and binascii.hexlify(csig).decode() != value:
+                    csig = None
+            else:
+                csig = None
+            if csig is None:
+                flags = flags | _CSIG_IS_STRING
+                csig = _uint.pack(self.string(value)) + b'\0' * 12
+        if 'timestamp' in state:
+            timestamp = state['timestamp']
+            if not isinstance(timestamp, _int_types) or isinstance(timestamp, bool):
+                return False
+            flags = flags | _HAS_TIMESTAMP
+        if 'size' in state:
+            size = state['size']
+            if not isinstance(size, _int_types) or isinstance(size, bool):
+                return False
+            flags = flags | _HAS_SIZE
+        try:
+            self.body.append(_ninfo.pack(flags, csig, timestamp, size))
+        except struct.error:
+            return False
+        return True
+
+    def ninfo(self, ninfo, file_ninfo_class):
+        if type(ninfo) is file_ninfo_class:
+            self.body.append(b'\0')
+            if self.file_ninfo(ninfo):
+                return
+            self.body.pop()
+        self.body.append(b'\1')
+        self.pickled(ninfo)
+
+    def entry(self, entry, classes):
+        entry_class, file_ninfo_class, file_binfo_class = classes
+        if type(entry) is not entry_class:
+            return False
+        state = entry.__getstate__()
+        if not _entry_fields.issuperset(state):
+            return False
+        binfo = state.get('binfo')
+        ninfo = state.get('ninfo')
+        if type(binfo) is not file_binfo_class or ninfo is None:
+            return False
+        bstate = binfo.__getstate__()
+        if not _binfo_fields.issuperset(bstate):
+            return False
+        for attr in _binfo_lists:
+            value = bstate.get(attr, ())
+            if not isinstance(value, list) or \
+               not all(isinstance(s, _str_types) for s in value):
+                return False
+        for attr in _binfo_sigs:
+            if not isinstance(bstate.get(attr, []), list):
+                return False
+        for attr in ('bactsig', 'bact'):
+            value = bstate.get(attr)
+            if value is not None and not isinstance(value, _str_types):
+                return False
+        duration = getattr(entry, 'duration', None)
+        if duration is not None and not isinstance(duration, (float,) + _int_types):
+            return False
+
+        mark = len(self.body)
+        self.ninfo(ninfo, file_ninfo_class)
+        presence = 0
+        for bit, attr in enumerate(_binfo_lists + _binfo_sigs):
+            if attr in bstate:
+                presence = presence | (1 << bit)
+        if 'bact' in bstate:
+            presence = presence | _HAS_BACT
+        self.body.append(struct.pack('<BII', presence,
+                                     self.string(bstate.get('bactsig')),
+                                     self.string(bstate.get('bact'))))
+        extras = 0
+        if getattr(entry, 'failed', False):
+            extras = extras | _HAS_FAILED
+        if duration is None:
+            self.body.append(struct.pack('<B', extras))
+        else:
+            self.body.append(struct.pack('<Bd', extras | _HAS_DURATION,
+                                         duration))
+        for attr in _binfo_lists:
+            value = bstate.get(attr, [])
+            self.body.append(_uint.pack(len(value)))
+            self.body.append(struct.pack('<%dI' % len(value),
+                                         *[self.string(s) for s in value]))
+        for attr in _binfo_sigs:
+            value = bstate.get(attr, [])
+            self.body.append(_uint.pack(len(value)))
+            for ni in value:
+                self.ninfo(ni, file_ninfo_class)
+        return mark
+
+    def finish(self):
+        table = []
+        for s in self.strings:
+            b = _encode_string(s)
+            table.append(_uint.pack(len(b)))
+            table.append(b)
+        return b''.join([_header.pack(magic, format_version),
+                         _uint.pack(len(self.strings))] +
+                        table + self.body)
+
+
+def _classes():
+    import SCons.Node.FS
+    import SCons.SConsign
+    return (SCons.SConsign.SConsignEntry,
+            SCons.Node.FS.FileNodeInfo,
+            SCons.Node.FS.FileBuildInfo)
+
+
+def encode(entries):
+    """
+    Encodes a dictionary mapping file names to SConsignEntry objects
+    (already converted with convert_to_sconsign()) into bytes.
+    """
+    classes = _classes()
+    enc = _Encoder()
+    enc.body.append(_uint.pack(len(entries)))
+    for name, entry in entries.items():
+        enc.body.append(_uint.pack(enc.string(name)))
+        enc.body.append(b'\0')
+        tag = len(enc.body) - 1
+        if enc.entry(entry, classes) is False:
+            enc.body[tag] = b'\1'
+            enc.pickled(entry)
+    return enc.finish()
+
+
+class _Decoder(object):
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def uint(self):
+        value = _uint.unpack_from(self.data, self.offset)[0]
+        self.offset = self.offset + 4
+        return value
+
+    def byte(self):
+        value = self.data[self.offset:self.offset + 1]
+        self.offset = self.offset + 1
+        return value
+
+    def pickled(self):
+        length = self.uint()
+        start = self.offset
+        self.offset = start + length
+        if self.offset > len(self.data):
+            raise CodecError("truncated data")
+        return pickle.loads(self.data[start:self.offset])
+
+    def strings(self):
+        count = self.uint()
+        result = []
+        data = self.data
+        for _ in range(count):
+            length = self.uint()
+            start = self.offset
+            self.offset = start + length
+            result.append(_decode_string(data[start:self.offset]))
+        self.table = result
+
+    def string(self, index):
+        if index == _NONE:
+            return None
+        return self.table[index]
+
+    def ninfo(self, file_ninfo_class):
+        if self.byte() != b'\0':
+            return self.pickled()
+        flags, csig, timestamp, size = _ninfo.unpack_from(self.data, self.offset)
+        self.offset = self.offset + _ninfo.size
+        ninfo = file_ninfo_class()
+        if flags & _HAS_CSIG:
+            if flags & _CSIG_IS_STRING:
+                ninfo.csig = self.table[_uint.unpack_from(csig)[0]]
+            else:
+                ninfo.csig = binascii.hexlify(csig).decode('ascii')
+        if flags & _HAS_TIMESTAMP:
+            ninfo.timestamp = timestamp
+        if flags & _HAS_SIZE:
+            ninfo.size = size
+        return ninfo
+
+    def entry(self, classes):
+        entry_class, file_ninfo_class, file_binfo_class = classes
+        entry = entry_class()
+        entry.ninfo = self.ninfo(file_ninfo_class)
+        binfo = file_binfo_class()
+        presence, bactsig, bact = struct.unpack_from('<BII', self.data, self.offset)
+        self.offset = self.offset + 9
+        if self.version >= 2:
+            extras = ord(self.byte())
+            if extras & _HAS_DURATION:
+                entry.duration = struct.unpack_from('<d', self.data, self.offset)[0]
+                self.offset = self.offset + 8
+            if extras & _HAS_FAILED:
+                entry.failed = True
+        binfo.bactsig = self.string(bactsig)
+        if presence & _HAS_BACT:
+            binfo.bact = self.string(bact)
+        table = self.table
+        for bit, attr in enumerate(_binfo_lists):
+            count = self.uint()
+            indexes = struct.unpack_from('<%dI' % count, self.data, self.offset)
+            self.offset = self.offset + 4 * count
+            if presence & (1 << bit):
+                setattr(binfo, attr, [table[i] for i in indexes])
+        for bit, attr in enumerate(_binfo_sigs, len(_binfo_lists)):
+            count = self.uint()
+            sigs = [self.ninfo(file_ninfo_class) for _ in range(count)]
+            if presence & (1 << bit):
+                setattr(binfo, attr, sigs)
+        entry.binfo = binfo
+        return entry
+
+
+def encode_pickle(entries):
+    """
+    Pickles a dictionary of SConsignEntry objects the way older versions
+    of SCons can read, followed by the entries' extras, if any.
+    """
+    data = pickle.dumps(entries, PICKLE_PROTOCOL)
+    extras = {}
+    for name, entry in entries.items():
+        try:
+            values = entry.get_extras()
+        except AttributeError:
+            continue
+        if values:
+            extras[name] = values
+    if extras:
+        data = data + pickle.dumps(extras, PICKLE_PROTOCOL)
+    return data
+
+
+def decode_pickle(data):
+    """
+    Unpickles data written by encode_pickle() (or by older versions of
+    SCons), putting the extras back on the entries.
+    """
+    f = io.BytesIO(data)
+    entries = pickle.load(f)
+    if f.tell() >= len(data) or not isinstance(entries, dict):
+        return entries
+    extras = pickle.load(f)
+    for name, values in extras.items():
+        entry = entries.get(name)
+        if entry is None:
+            continue
+        for attr, value in values.items():
+            if attr in getattr(entry, 'extra_fields', ()):
+                setattr(entry, attr, value)
+    return entries
+
+
+def decode(data):
+    """
+    Decodes bytes produced by encode()--or by encode_pickle() or pickling
+    the dictionary, as older versions of SCons did--back into a
+    dictionary of SConsignEntry objects.
+    """
+    if not is_encoded(data):
+        return decode_pickle(data)
+    dec = _Decoder(data)
+    _, version = _header.unpack_from(data, 0)
+    if version not in read_versions:
+        raise CodecError("unsupported .sconsign encoding version %d" % version)
+    dec.version = version
+    dec.offset = _header.size
+    classes = _classes()
+    try:
+        dec.strings()
+        entries = {}
+        for _ in range(dec.uint()):
+            name = dec.table[dec.uint()]
+            if dec.byte() == b'\0':
+                entries[name] = dec.entry(classes)
+            else:
+                entries[name] = dec.pickled()
+    except (struct.error, IndexError, TypeError, UnicodeDecodeError) as e:
+        raise CodecError("corrupt .sconsign data: %s" % e)
+    return entries
+
+# Local Variables:
+# tab-width:4
+# indent-tabs-mode:nil
+# End:
+# vim: set expandtab tabstop=4 shiftwidth=4:
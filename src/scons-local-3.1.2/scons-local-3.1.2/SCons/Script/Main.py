@@ -61,8 +61,10 @@ import SCons.Node.FS
 import SCons.Platform
 import SCons.Platform.virtualenv
 import SCons.SConf
+import SCons.SConsign
 import SCons.Script
 import SCons.Taskmaster
+import SCons.Timeline
 import SCons.Util
 import SCons.Warnings
 
@@ -82,6 +84,8 @@ exit_status = 0   # final exit status, assume success by default
 this_build_status = 0   # "exit status" of an individual build
 num_jobs = None
 delayed_warnings = []
+build_estimate = None
+eta_interval = 10.0    # seconds between --eta reports
 
 
 def fetch_win32_parallel_msg():
@@ -111,10 +115,210 @@ display = SCons.Util.display
 progress_display = SCons.Util.DisplayEngine()
 
 
+def format_duration(seconds):
+    """Formats a number of seconds as, e.g., '1h02m', '3m07s' or '12s'."""
+    seconds = int(seconds + 0.5)
+    if seconds >= 3600:
+        return '%dh%02dm' % (seconds // 3600, (seconds % 3600) // 60)
+    if seconds >= 60:
+        return '%dm%02ds' % (seconds // 60, seconds % 60)
+    return '%ds' % seconds
+
+
+class BuildEstimate(object):
+    """
+    Estimates how long the rest of a build will take from the build
+    times recorded in the .sconsign file by earlier builds.
+
+    start() walks the dependency graph (without scanning) and counts the
+    tasks that build derived Files.  Their recorded build times are only
+    looked up as the Taskmaster gets to each task, when it has read the
+    .sconsign entries of its targets anyway to decide whether they're out
+    of date; tasks that have never been built are taken to cost the
+    average of the recorded times seen so far.  The cost of out-of-date
+    tasks stays in the estimate until they are built, and the tasks not
+    checked yet are taken to cost the average each, weighted by the
+    fraction of checked tasks that turned out to be out of date.  The
+    remaining work is scaled by how the actual build times have compared
+    to the recorded ones so far in this build, and divided among the jobs.
+    """
+    def __init__(self, jobs=1):
+        self.jobs = max(jobs, 1)
+        self.executors = set()
+        self.unchecked = 0
+        self.queued = 0.0
+        self.queued_unknown = 0
+        self.checked = 0
+        self.out_of_date = 0
+        self.built = 0
+        self.estimated_done = 0.0
+        self.actual_done = 0.0
+        self.recorded = 0
+        self.recorded_time = 0.0
+        self.start_time = None
+        self.last_report = None
+
+    def start(self, targets):
+        executors = self.executors
+        seen = set()
+        stack = list(targets)
+        while stack:
+            node = stack.pop()
+            if node in seen:
+                continue
+            seen.add(node)
+            try:
+                node = node.disambiguate()
+            except (EnvironmentError, SCons.Errors.UserError):
+                continue
+            if isinstance(node, SCons.Node.FS.Dir):
+                for name, entry in node.entries.items():
+                    if name not in ('.', '..'):
+                        stack.append(entry)
+                continue
+            stack.extend(node.children(scan=0))
+            if isinstance(node, SCons.Node.FS.File) and node.has_builder():
+                # All the targets of a builder call are built by one task.
+                executors.add(node.get_executor())
+        self.unchecked = len(executors)
+        self.start_time = self.last_report = time.time()
+
+    def checked_task(self, task):
+        """Called when the Taskmaster has decided whether a task is out of
+        date."""
+        node = task.targets[0]
+        if not node.has_builder():
+            return
+        try:
+            self.executors.remove(node.get_executor())
+        except KeyError:
+            return
+        self.unchecked = self.unchecked - 1
+        self.checked = self.checked + 1
+        # Each target of the task records the task's time.
+        cost = None
+        for t in task.targets:
+            cost = t.get_stored_duration()
+            if cost is not None:
+                break
+        if cost is not None:
+            self.recorded = self.recorded + 1
+            self.recorded_time = self.recorded_time + cost
+        if task.out_of_date:
+            self.out_of_date = self.out_of_date + 1
+            task.estimated_cost = cost
+            if cost is None:
+                self.queued_unknown = self.queued_unknown + 1
+            else:
+                self.queued = self.queued + cost
+
+    def finished_task(self, task):
+        """Called when an out-of-date task has been built (or has failed)."""
+        try:
+            cost = task.estimated_cost
+        except AttributeError:
+            return
+        del task.estimated_cost
+        self.built = self.built + 1
+        if cost is None:
+            self.queued_unknown = max(self.queued_unknown - 1, 0)
+            return
+        self.queued = max(self.queued - cost, 0.0)
+        if task.duration is not None and cost:
+            self.estimated_done = self.estimated_done + cost
+            self.actual_done = self.actual_done + task.duration
+
+    def remaining(self):
+        """Returns the estimated number of seconds left, or None if no
+        build times have been recorded to estimate from yet."""
+        if not self.recorded:
+            return None
+        average = self.recorded_time / self.recorded
+        if self.checked:
+            fraction = float(self.out_of_date) / self.checked
+        else:
+            fraction = 1.0
+        work = self.queued + \
+               (self.queued_unknown + self.unchecked * fraction) * average
+        if self.estimated_done and self.actual_done:
+            work = work * self.actual_done / self.estimated_done
+        return work / self.jobs
+
+    def elapsed(self):
+        if self.start_time is None:
+            return 0.0
+        return time.time() - self.start_time
+
+    def percent(self):
+        remaining = self.remaining()
+        if remaining is None:
+            return None
+        elapsed = self.elapsed()
+        if elapsed + remaining <= 0:
+            return 100
+        return int(100 * elapsed / (elapsed + remaining))
+
+    def substitute(self, s):
+        """Replaces $ETA, $ELAPSED and $PERCENT in a Progress() string."""
+        remaining = self.remaining()
+        if remaining is None:
+            s = s.replace('$ETA', '?').replace('$PERCENT', '?%')
+        else:
+            s = s.replace('$ETA', format_duration(remaining))
+            s = s.replace('$PERCENT', '%d%%' % self.percent())
+        return s.replace('$ELAPSED', format_duration(self.elapsed()))
+
+    def report(self, force=False):
+        """Displays the estimate, at most once every eta_interval seconds
+        unless forced."""
+        now = time.time()
+        if not force and now - self.last_report < eta_interval:
+            return
+        self.last_report = now
+        display(self.substitute(
+            "scons: about $ETA left, $PERCENT done after $ELAPSED "
+            "(%d built, %d of %d out of date)" %
+            (self.built, self.out_of_date, self.checked)))
+
+
+def previously_failed(targets):
+    """
+    Returns the Nodes the given targets depend on whose last build
+    failed, in the order a walk down from the targets finds them.
+
+    This walk doesn't scan anything; it follows the explicit children of
+    each Node and the entries of directories.
+    """
+    seen = set()
+    stack = list(targets)
+    stack.reverse()
+    result = []
+    while stack:
+        node = stack.pop()
+        if node in seen:
+            continue
+        seen.add(node)
+        try:
+            node = node.disambiguate()
+        except (EnvironmentError, SCons.Errors.UserError):
+            continue
+        if isinstance(node, SCons.Node.FS.Dir):
+            children = [e for n, e in node.entries.items()
+                        if n not in ('.', '..')]
+        else:
+            if node.has_builder() and node.get_stored_failed():
+                result.append(node)
+            children = node.children(scan=0)
+        stack.extend(reversed(children))
+    return result
+
+
 class Progressor(object):
     prev = ''
     count = 0
     target_string = '$TARGET'
+    estimate_strings = ('$ETA', '$ELAPSED', '$PERCENT')
+    estimate = False
 
     def __init__(self, obj, interval=1, file=None, overwrite=False):
         if file is None:
@@ -129,10 +333,14 @@ class Progressor(object):
             self.func = obj
         elif SCons.Util.is_List(obj):
             self.func = self.spinner
-        elif obj.find(self.target_string) != -1:
-            self.func = self.replace_string
         else:
-            self.func = self.string
+            for s in self.estimate_strings:
+                if obj.find(s) != -1:
+                    self.estimate = True
+            if self.estimate or obj.find(self.target_string) != -1:
+                self.func = self.replace_string
+            else:
+                self.func = self.string
 
     def write(self, s):
         self.file.write(s)
@@ -154,7 +362,10 @@ class Progressor(object):
         self.write(self.obj)
 
     def replace_string(self, node):
-        self.write(self.obj.replace(self.target_string, str(node)))
+        s = self.obj.replace(self.target_string, str(node))
+        if self.estimate and build_estimate is not None:
+            s = build_estimate.substitute(s)
+        self.write(s)
 
     def __call__(self, node):
         self.count = self.count + 1
@@ -187,6 +398,8 @@ class BuildTask(SCons.Taskmaster.OutOfDateTask):
         display('scons: ' + message)
 
     def prepare(self):
+        if build_estimate is not None:
+            build_estimate.checked_task(self)
         self.progress(self.targets[0])
         return SCons.Taskmaster.OutOfDateTask.prepare(self)
 
@@ -219,6 +432,12 @@ class BuildTask(SCons.Taskmaster.OutOfDateTask):
         _BuildFailures.append(self.exception[1])
         global exit_status
         global this_build_status
+        if not self.options.ignore_errors and not self.options.no_exec and \
+           getattr(self.exception[1], 'errstr', None) != SCons.Job.interrupt_msg:
+            # Remember the failure, for --schedule=failed-first.
+            for t in self.targets:
+                if t.has_builder():
+                    t.store_failed(True)
         if self.options.ignore_errors:
             SCons.Taskmaster.OutOfDateTask.executed(self)
         elif self.options.keep_going:
@@ -322,6 +541,12 @@ class BuildTask(SCons.Taskmaster.OutOfDateTask):
                     print()
                     print(tree)
         SCons.Taskmaster.OutOfDateTask.postprocess(self)
+        if self.out_of_date:
+            SCons.SConsign.task_completed()
+        if build_estimate is not None:
+            build_estimate.finished_task(self)
+            if self.options.eta:
+                build_estimate.report()
 
     def make_ready(self):
         """Make a task ready for execution"""
@@ -1016,6 +1241,9 @@ def _main(parser):
 
     progress_display("scons: Reading SConscript files ...")
 
+    if options.trace_events:
+        SCons.Timeline.start(options.trace_events)
+
     start_time = time.time()
     try:
         for script in scripts:
@@ -1031,6 +1259,7 @@ def _main(parser):
         sys.exit(2)
     global sconscript_time
     sconscript_time = time.time() - start_time
+    SCons.Timeline.span('read SConscript files', 'sconscript', start_time)
 
     progress_display("scons: done reading SConscript files.")
 
@@ -1103,16 +1332,29 @@ def _main(parser):
     fs.set_max_drift(options.max_drift)
 
     SCons.Job.explicit_stack_size = options.stack_size
+    SCons.Job.max_load = options.load_average
+    SCons.Job.serve_jobserver = options.jobserver
+    SCons.Job.parallel_checks = options.parallel_checks
+    for name, units in (options.resource_pools or {}).items():
+        SCons.Job.set_resource_pool(name, units, override=True)
 
     if options.md5_chunksize:
         SCons.Node.FS.File.md5_chunksize = options.md5_chunksize
 
+    SCons.SConsign.sconsign_format = options.sconsign_format
+    if not options.no_exec:
+        SCons.SConsign.checkpoint_interval = options.checkpoint_interval
+        SCons.SConsign.checkpoint_tasks = options.checkpoint_tasks
+
     platform = SCons.Platform.platform_module()
 
     if options.interactive:
         SCons.Script.Interactive.interact(fs, OptionsParser, options,
                                           targets, target_top)
 
+    elif options.sconsign_gc:
+        _collect_sconsign_garbage(fs, options)
+
     else:
 
         # Build the targets
@@ -1122,6 +1364,18 @@ def _main(parser):
             print('Found nothing to build')
             exit_status = 2
 
+def _collect_sconsign_garbage(fs, options):
+    entries, dirs, reclaimed = \
+        SCons.SConsign.collect_garbage(fs, dry_run=options.no_exec)
+    if not options.no_exec:
+        SCons.SConsign.write()
+    if options.no_exec:
+        verb = "Would remove"
+    else:
+        verb = "Removed"
+    print("scons: %s %d unused .sconsign entries (%d directories), "
+          "reclaiming %d bytes." % (verb, entries, dirs, reclaimed))
+
 def _build_targets(fs, options, targets, target_top):
 
     global this_build_status
@@ -1142,6 +1396,10 @@ def _build_targets(fs, options, targets, target_top):
     SCons.CacheDir.cache_debug = options.cache_debug
     SCons.CacheDir.cache_force = options.cache_force
     SCons.CacheDir.cache_show = options.cache_show
+    SCons.CacheDir.push_threads = options.cache_push_threads
+    SCons.CacheDir.retrieve_strategy = options.cache_retrieve
+    SCons.CacheDir.cache_report = options.cache_report
+    SCons.CacheDir.cache_explain = options.cache_explain
 
     if options.no_exec:
         CleanTask.execute = CleanTask.show
@@ -1262,7 +1520,18 @@ def _build_targets(fs, options, targets, target_top):
         tmtrace = open(options.taskmastertrace_file, 'w')
     else:
         tmtrace = None
-    taskmaster = SCons.Taskmaster.Taskmaster(nodes, task_class, order, tmtrace)
+    if options.schedule == 'critical-path':
+        priority = SCons.Taskmaster.CriticalPath()
+    else:
+        priority = None
+    if options.schedule == 'failed-first' and task_class is BuildTask:
+        first = previously_failed(nodes)
+    else:
+        first = ()
+    taskmaster = SCons.Taskmaster.Taskmaster(nodes, task_class, order, tmtrace,
+                                             priority,
+                                             options.dag_walk == 'incremental',
+                                             first)
 
     # Let the BuildTask objects get at the options to respond to the
     # various print_* settings, tree_printer list, etc.
@@ -1313,8 +1582,21 @@ def _build_targets(fs, options, targets, target_top):
             if jobs.were_interrupted():
                 progress_display("scons: writing .sconsign file.")
             SCons.SConsign.write()
+            SCons.CacheDir.wait_for_pushes()
+            SCons.CacheDir.write_cache_report()
+            SCons.CacheDir.trim_caches()
+        SCons.Timeline.write()
 
     progress_display("scons: " + opening_message)
+    if options.prehash and task_class is not CleanTask:
+        SCons.Node.FS.prehash_sources(nodes, options.prehash)
+    global build_estimate
+    if task_class is BuildTask and \
+       (options.eta or getattr(ProgressObject, 'estimate', False)):
+        build_estimate = BuildEstimate(jobs.num_jobs)
+        build_estimate.start(nodes)
+        if options.eta:
+            build_estimate.report(force=True)
     jobs.run(postfunc = jobs_postfunc)
 
     memory_stats.append('after building targets:')
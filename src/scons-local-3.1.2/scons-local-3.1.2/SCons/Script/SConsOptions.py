@@ -37,8 +37,11 @@ except ImportError:
         return message
 _ = gettext
 
+import SCons.CacheDir
 import SCons.Node.FS
 import SCons.Platform.virtualenv
+import SCons.SConsign
+import SCons.Taskmaster
 import SCons.Warnings
 
 OptionValueError        = optparse.OptionValueError
@@ -128,16 +131,25 @@ class SConsValues(optparse.Values):
 
 
     settable = [
+        'checkpoint_interval',
+        'checkpoint_tasks',
         'clean',
+        'dag_walk',
         'diskcheck',
         'duplicate',
         'help',
         'implicit_cache',
+        'jobserver',
+        'load_average',
         'max_drift',
         'md5_chunksize',
         'no_exec',
         'num_jobs',
+        'parallel_checks',
+        'prehash',
         'random',
+        'schedule',
+        'sconsign_format',
         'stack_size',
         'warn',
         'silent'
@@ -157,6 +169,13 @@ class SConsValues(optparse.Values):
                     raise ValueError
             except ValueError:
                 raise SCons.Errors.UserError("A positive integer is required: %s"%repr(value))
+        elif name == 'load_average':
+            try:
+                value = float(value)
+                if value < 0:
+                    raise ValueError
+            except ValueError:
+                raise SCons.Errors.UserError("A non-negative number is required: %s"%repr(value))
         elif name == 'max_drift':
             try:
                 value = int(value)
@@ -172,6 +191,9 @@ class SConsValues(optparse.Values):
             # Set the duplicate style right away so it can affect linking
             # of SConscript files.
             SCons.Node.FS.set_duplicate(value)
+        elif name == 'dag_walk':
+            if value not in SCons.Taskmaster.dag_walks:
+                raise SCons.Errors.UserError("Not a valid DAG walk: %s" % value)
         elif name == 'diskcheck':
             try:
                 value = diskcheck_convert(value)
@@ -182,6 +204,13 @@ class SConsValues(optparse.Values):
                 # Set this right away so it can affect the rest of the
                 # file/Node lookups while processing the SConscript files.
                 SCons.Node.FS.set_diskcheck(value)
+        elif name == 'prehash':
+            try:
+                value = int(value)
+                if value < 0:
+                    raise ValueError
+            except ValueError:
+                raise SCons.Errors.UserError("A non-negative integer is required: %s"%repr(value))
         elif name == 'stack_size':
             try:
                 value = int(value)
@@ -192,6 +221,19 @@ class SConsValues(optparse.Values):
                 value = int(value)
             except ValueError:
                 raise SCons.Errors.UserError("An integer is required: %s"%repr(value))
+        elif name in ('checkpoint_interval', 'checkpoint_tasks'):
+            try:
+                value = int(value)
+                if value < 0:
+                    raise ValueError
+            except ValueError:
+                raise SCons.Errors.UserError("A non-negative integer is required: %s"%repr(value))
+        elif name == 'schedule':
+            if value not in SCons.Taskmaster.schedules:
+                raise SCons.Errors.UserError("Not a valid scheduling mode: %s" % value)
+        elif name == 'sconsign_format':
+            if value not in SCons.SConsign.sconsign_formats:
+                raise SCons.Errors.UserError("Not a valid .sconsign format: %s" % value)
         elif name == 'warn':
             if SCons.Util.is_String(value):
                 value = [value]
@@ -568,21 +610,71 @@ def Parser(version):
                   action="store_true",
                   help="Do not retrieve built targets from CacheDir.")
 
+    op.add_option('--cache-explain',
+                  dest='cache_explain', default=False,
+                  action="store_true",
+                  help="Explain why targets are not found in CacheDir.")
+
     op.add_option('--cache-force', '--cache-populate',
                   dest='cache_force', default=False,
                   action="store_true",
                   help="Copy already-built targets into the CacheDir.")
 
+    op.add_option('--cache-push-threads',
+                  nargs=1, type="int",
+                  dest='cache_push_threads', default=0,
+                  action="store",
+                  help="Copy built targets into CacheDir using N "
+                       "background threads.",
+                  metavar="N")
+
     op.add_option('--cache-readonly',
                   dest='cache_readonly', default=False,
                   action="store_true",
                   help="Do not update CacheDir with built targets.")
 
+    def opt_cache_retrieve(option, opt, value, parser):
+        if value not in SCons.CacheDir.retrieve_strategies:
+            raise OptionValueError(opt_invalid('cache retrieval', value,
+                                               SCons.CacheDir.retrieve_strategies))
+        setattr(parser.values, option.dest, value)
+
+    op.add_option('--cache-report',
+                  nargs=1,
+                  dest="cache_report", default=None,
+                  action="store",
+                  help="Append a JSON record of each CacheDir lookup "
+                       "and push to FILE.",
+                  metavar="FILE")
+
+    op.add_option('--cache-retrieve',
+                  nargs=1, type="string",
+                  dest="cache_retrieve", default='copy',
+                  action="callback", callback=opt_cache_retrieve,
+                  help="How to put files retrieved from CacheDir in place: " +
+                       ", ".join(SCons.CacheDir.retrieve_strategies) + ".",
+                  metavar="STRATEGY")
+
     op.add_option('--cache-show',
                   dest='cache_show', default=False,
                   action="store_true",
                   help="Print build actions for files from CacheDir.")
 
+    op.add_option('--checkpoint-interval',
+                  nargs=1, type="int",
+                  dest="checkpoint_interval", default=0,
+                  action="store",
+                  help="Save signature information every N seconds "
+                       "during the build.",
+                  metavar="N")
+
+    op.add_option('--checkpoint-tasks',
+                  nargs=1, type="int",
+                  dest="checkpoint_tasks", default=0,
+                  action="store",
+                  help="Save signature information every N built tasks.",
+                  metavar="N")
+
     def opt_invalid(group, value, options):
         """report an invalid option from a group"""
         errmsg  = "`%s' is not a valid %s option type, try:\n" % (value, group)
@@ -610,6 +702,20 @@ def Parser(version):
                   help="Search up directory tree for SConstruct,       "
                        "build all Default() targets.")
 
+    def opt_dag_walk(option, opt, value, parser):
+        if value not in SCons.Taskmaster.dag_walks:
+            raise OptionValueError(opt_invalid('DAG walk', value,
+                                               SCons.Taskmaster.dag_walks))
+        setattr(parser.values, option.dest, value)
+
+    op.add_option('--dag-walk',
+                  nargs=1, type="string",
+                  dest="dag_walk", default='classic',
+                  action="callback", callback=opt_dag_walk,
+                  help="Walk the dependency graph the WALK way: " +
+                       ", ".join(SCons.Taskmaster.dag_walks) + ".",
+                  metavar="WALK")
+
     deprecated_debug_options = {}
 
     removed_debug_options = {
@@ -694,6 +800,12 @@ def Parser(version):
                      action="store_true",
                      help="Import certain virtualenv variables to SCons")
 
+    op.add_option('--eta',
+                  dest='eta', default=False,
+                  action="store_true",
+                  help="Periodically report the estimated time left, "
+                       "from the build times of earlier builds.")
+
     op.add_option('-f', '--file', '--makefile', '--sconstruct',
                   nargs=1, type="string",
                   dest="file", default=[],
@@ -757,11 +869,25 @@ def Parser(version):
                   help="Allow N jobs at once.",
                   metavar="N")
 
+    op.add_option('--jobserver',
+                  dest='jobserver', default=False,
+                  action="store_true",
+                  help="With -j, share the N jobs with the commands run "
+                       "through a GNU make jobserver.")
+
     op.add_option('-k', '--keep-going',
                   dest='keep_going', default=False,
                   action="store_true",
                   help="Keep going when a target can't be made.")
 
+    op.add_option('-l', '--load-average', '--max-load',
+                  nargs=1, type="float",
+                  dest="load_average", default=0,
+                  action="store",
+                  help="Don't start multiple jobs unless load is below "
+                       "LOAD-AVERAGE.",
+                  metavar="LOAD-AVERAGE")
+
     op.add_option('--max-drift',
                   nargs=1, type="int",
                   dest='max_drift', default=SCons.Node.FS.default_max_drift,
@@ -786,6 +912,20 @@ def Parser(version):
                   action="store_true",
                   help="Don't search or use the usual site_scons dir.")
 
+    op.add_option('--parallel-checks',
+                  dest='parallel_checks', default=False,
+                  action="store_true",
+                  help="With -j, run up-to-date checks on the worker "
+                       "threads.")
+
+    op.add_option('--prehash',
+                  nargs=1, type="int",
+                  dest="prehash", default=0,
+                  action="store",
+                  help="Hash changed source files on THREADS threads "
+                       "before building.",
+                  metavar="THREADS")
+
     op.add_option('--profile',
                   nargs=1,
                   dest="profile_file", default=None,
@@ -808,6 +948,63 @@ def Parser(version):
                   action="store_true",
                   help="Build dependencies in random order.")
 
+    def opt_resource_pool(option, opt, value, parser):
+        name, sep, units = value.partition('=')
+        try:
+            units = int(units)
+            if not name or units < 1:
+                raise ValueError
+        except ValueError:
+            raise OptionValueError("Invalid resource pool `%s' "
+                                   "(expected NAME=UNITS)" % value)
+        # Build a new dictionary rather than adding to the one we have,
+        # which could be shared with other parses.
+        pools = dict(getattr(parser.values, option.dest) or {})
+        pools[name] = units
+        setattr(parser.values, option.dest, pools)
+
+    op.add_option('--resource-pool',
+                  nargs=1, type="string",
+                  dest="resource_pools", default=None,
+                  action="callback", callback=opt_resource_pool,
+                  help="Let jobs use at most UNITS of resource pool NAME "
+                       "at once.",
+                  metavar="NAME=UNITS")
+
+    def opt_schedule(option, opt, value, parser):
+        if value not in SCons.Taskmaster.schedules:
+            raise OptionValueError(opt_invalid('scheduling mode', value,
+                                               SCons.Taskmaster.schedules))
+        setattr(parser.values, option.dest, value)
+
+    op.add_option('--schedule',
+                  nargs=1, type="string",
+                  dest="schedule", default='default',
+                  action="callback", callback=opt_schedule,
+                  help="Order ready tasks by MODE: " +
+                       ", ".join(SCons.Taskmaster.schedules) + ".",
+                  metavar="MODE")
+
+    def opt_sconsign_format(option, opt, value, parser):
+        if value not in SCons.SConsign.sconsign_formats:
+            raise OptionValueError(opt_invalid('sconsign format', value,
+                                               SCons.SConsign.sconsign_formats))
+        setattr(parser.values, option.dest, value)
+
+    op.add_option('--sconsign-format',
+                  nargs=1, type="string",
+                  dest="sconsign_format", default='pickle',
+                  action="callback", callback=opt_sconsign_format,
+                  help="Write .sconsign entries in FORMAT: " +
+                       ", ".join(SCons.SConsign.sconsign_formats) + ".",
+                  metavar="FORMAT")
+
+    op.add_option('--sconsign-gc',
+                  dest="sconsign_gc", default=False,
+                  action="store_true",
+                  help="Don't build; remove unused entries from the "
+                       ".sconsign file(s) and report the space reclaimed.")
+
     op.add_option('-s', '--silent', '--quiet',
                   dest="silent", default=False,
                   action="store_true",
@@ -834,6 +1031,13 @@ def Parser(version):
                   help="Trace Node evaluation to FILE.",
                   metavar="FILE")
 
+    op.add_option('--trace-events',
+                  nargs=1,
+                  dest="trace_events", default=None,
+                  action="store",
+                  help="Write a Chrome trace-event timeline of the build to FILE.",
+                  metavar="FILE")
+
     tree_options = ["all", "derived", "prune", "status"]
 
     def opt_tree(option, opt, value, parser, tree_options=tree_options):
@@ -909,14 +1113,6 @@ def Parser(version):
         msg = "Warning:  the %s option is not yet implemented\n" % opt
         sys.stderr.write(msg)
 
-    op.add_option('-l', '--load-average', '--max-load',
-                  nargs=1, type="float",
-                  dest="load_average", default=0,
-                  action="callback", callback=opt_not_yet,
-                  # action="store",
-                  # help="Don't start multiple jobs unless load is below "
-                  #      "LOAD-AVERAGE."
-                  help=SUPPRESS_HELP)
     op.add_option('--list-actions',
                   dest="list_actions",
                   action="callback", callback=opt_not_yet,
@@ -342,6 +342,8 @@ GlobalDefaultEnvironmentFunctions = [
     'PyPackageDir',
     'Repository',
     'Requires',
+    'ResourcePool',
+    'Resources',
     'SConsignFile',
     'SideEffect',
     'SourceCode',
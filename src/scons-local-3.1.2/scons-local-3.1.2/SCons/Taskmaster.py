@@ -57,12 +57,15 @@ __doc__ = """
 __revision__ = "src/engine/SCons/Taskmaster.py bee7caf9defd6e108fc2998a2520ddb36a967691 2019-12-17 02:07:09 bdeegan"
 
 from itertools import chain
+import heapq
 import operator
 import sys
+import time
 import traceback
 
 import SCons.Errors
 import SCons.Node
+import SCons.Timeline
 import SCons.Warnings
 
 StateString = SCons.Node.StateString
@@ -81,6 +84,27 @@ print_prepare = 0               # set by option --debug=prepare
 
 CollectStats = None
 
+# With a priority function, the Taskmaster looks ahead for up to this
+# many ready Nodes and hands out the highest priority one first.  The
+# look-ahead is filled a little at a time, so the first task doesn't
+# wait for it:  the first request for a task takes the first ready Node
+# found, and each one after that finds at most priority_refill more.
+priority_window = 1000
+priority_refill = 8
+
+# The scheduling modes that the --schedule option can pick.  The
+# failed-first mode walks the targets whose last build failed (and so
+# their prerequisites) before the rest of the DAG, so a build that is
+# still broken fails as soon as possible.
+schedules = ('default', 'critical-path', 'failed-first')
+
+# The ways of walking the DAG that the --dag-walk option can pick.  The
+# classic walk scans a Node's children every time the Node comes up as a
+# candidate; the incremental one scans them once and after that only
+# again if building a child reset the Node's implicit dependencies, so
+# most edges are looked at a constant number of times.
+dag_walks = ('classic', 'incremental')
+
 class Stats(object):
     """
     A simple class for holding statistics about the disposition of a
@@ -142,6 +166,9 @@ class Task(object):
         self.targets = targets
         self.top = top
         self.node = node
+        self.duration = None
+        self.defer_current = False
+        self.current_pending = False
         self.exc_clear()
 
     def trace_message(self, method, node, description='node'):
@@ -252,7 +279,12 @@ class Task(object):
                         t.fs.unlink(t.get_internal_path())
                     except (IOError, OSError):
                         pass
+                start = time.time()
                 self.targets[0].build()
+                self.duration = time.time() - start
+                if SCons.Timeline.trace_file is not None:
+                    SCons.Timeline.span('build', 'action', start,
+                                        {'node' : str(self.node)})
             else:
                 for t in cached_targets:
                     t.cached = 1
@@ -312,10 +344,16 @@ class Task(object):
                     t.push_to_cache()
                 t.built()
                 t.visited()
+                if self.duration is not None:
+                    t.store_duration(self.duration)
+                if t.get_stored_failed():
+                    t.store_failed(False)
                 if (not print_prepare and
                     (not hasattr(self, 'options') or not self.options.debug_includes)):
                     t.release_target_info()
             else:
+                if t.get_stored_failed():
+                    t.store_failed(False)
                 t.visited()
 
     executed = executed_with_callbacks
@@ -422,20 +460,32 @@ class Task(object):
                 for s in t.side_effects:
                     # add disambiguate here to mirror the call on targets in first loop above
                     s.disambiguate().set_state(NODE_EXECUTING)
+        elif self.defer_current:
+            # We're on a worker thread (see Taskmaster.ready_task()), and
+            # recording the targets' signatures isn't thread safe, so
+            # leave that to the main thread.
+            self.current_pending = True
         else:
-            for t in self.targets:
-                # We must invoke visited() to ensure that the node
-                # information has been computed before allowing the
-                # parent nodes to execute. (That could occur in a
-                # parallel build...)
-                t.visited()
-                t.set_state(NODE_UP_TO_DATE)
-                if (not print_prepare and
-                    (not hasattr(self, 'options') or not self.options.debug_includes)):
-                    t.release_target_info()
+            self.make_current()
 
     make_ready = make_ready_current
 
+    def make_current(self):
+        """
+        Marks all targets in a task up to date.
+        """
+        self.current_pending = False
+        for t in self.targets:
+            # We must invoke visited() to ensure that the node
+            # information has been computed before allowing the
+            # parent nodes to execute. (That could occur in a
+            # parallel build...)
+            t.visited()
+            t.set_state(NODE_UP_TO_DATE)
+            if (not print_prepare and
+                (not hasattr(self, 'options') or not self.options.debug_includes)):
+                t.release_target_info()
+
     def postprocess(self):
         """
         Post-processes a task after it's been executed.
@@ -596,6 +646,57 @@ class OutOfDateTask(Task):
         return self.targets[0].get_state() == SCons.Node.executing
 
 
+class CriticalPath(object):
+    """
+    A Taskmaster priority function that ranks a ready Node by the length
+    of the longest chain of recorded build times from it up through the
+    Nodes waiting on it, so the work that holds up the most downstream
+    work starts first.
+
+    Nodes without a recorded time count as long as the average of the
+    recorded times seen so far; Nodes without a builder count as zero.
+    Lengths are worked out once per Node, from the waiting parents it
+    has at the time.
+    """
+    def __init__(self):
+        self.lengths = {}
+        self.total = 0.0
+        self.count = 0
+
+    def duration(self, node):
+        if not node.has_builder():
+            return 0.0
+        duration = node.get_stored_duration()
+        if duration is None:
+            if self.count:
+                return self.total / self.count
+            return 0.0
+        self.total = self.total + duration
+        self.count = self.count + 1
+        return duration
+
+    def __call__(self, node):
+        lengths = self.lengths
+        visiting = set()
+        stack = [node]
+        while stack:
+            n = stack[-1]
+            if n in lengths:
+                stack.pop()
+                continue
+            pending = [p for p in n.waiting_parents if p not in lengths]
+            if pending and n not in visiting:
+                visiting.add(n)
+                stack.extend(pending)
+                continue
+            stack.pop()
+            longest = 0.0
+            for p in n.waiting_parents:
+                longest = max(longest, lengths.get(p, 0.0))
+            lengths[n] = self.duration(n) + longest
+        return lengths[node]
+
+
 def find_cycle(stack, visited):
     if stack[-1] in visited:
         return None
@@ -615,9 +716,12 @@ class Taskmaster(object):
     The Taskmaster for walking the dependency DAG.
     """
 
-    def __init__(self, targets=[], tasker=None, order=None, trace=None):
+    def __init__(self, targets=[], tasker=None, order=None, trace=None,
+                 priority=None, incremental=False, first=()):
         self.original_top = targets
-        self.top_targets_left = targets[:]
+        # The 'first' Nodes are walked before the targets, but without
+        # being treated as top-level targets themselves.
+        self.top_targets_left = list(first) + targets
         self.top_targets_left.reverse()
         self.candidates = []
         if tasker is None:
@@ -630,6 +734,13 @@ class Taskmaster(object):
         self.trace = trace
         self.next_candidate = self.find_next_candidate
         self.pending_children = set()
+        self.priority = priority
+        self.ready = []
+        self.ready_nodes = set()
+        self.ready_count = 0
+        self.incremental = incremental
+        self.scanned = set()
+        self.queued = set()
 
     def find_next_candidate(self):
         """
@@ -679,6 +790,11 @@ class Taskmaster(object):
             candidates = self.candidates
             self.candidates = []
             self.will_not_build(candidates)
+        if self.ready:
+            ready = [entry[2] for entry in self.ready]
+            self.ready = []
+            self.ready_nodes = set()
+            self.will_not_build(ready)
         return None
 
     def _validate_pending_children(self):
@@ -767,6 +883,18 @@ class Taskmaster(object):
                                     node.ref_count,
                                     repr(str(node)))
 
+    def _scan_current(self, executor):
+        """
+        Returns whether the children found by the last scan of the
+        targets of the given executor are still what they'd be now.
+        Building a Node resets the implicit dependencies of the Nodes
+        waiting on it, so they'll be scanned again.
+        """
+        for t in executor.get_all_targets():
+            if t.implicit is None:
+                return False
+        return True
+
     def _find_next_ready_node(self):
         """
         Finds the next node that is ready to be built.
@@ -833,103 +961,124 @@ class Taskmaster(object):
 
             executor = node.get_executor()
 
-            try:
-                children = executor.get_all_children()
-            except SystemExit:
-                exc_value = sys.exc_info()[1]
-                e = SCons.Errors.ExplicitExit(node, exc_value.code)
-                self.ready_exc = (SCons.Errors.ExplicitExit, e)
-                if T: T.write(self.trace_message('       SystemExit'))
-                return node
-            except Exception as e:
-                # We had a problem just trying to figure out the
-                # children (like a child couldn't be linked in to a
-                # VariantDir, or a Scanner threw something).  Arrange to
-                # raise the exception when the Task is "executed."
-                self.ready_exc = sys.exc_info()
-                if S: S.problem = S.problem + 1
-                if T: T.write(self.trace_message('       exception %s while scanning children.\n' % e))
-                return node
-
-            children_not_visited = []
-            children_pending = set()
-            children_not_ready = []
-            children_failed = False
-
-            for child in chain(executor.get_all_prerequisites(), children):
-                childstate = child.get_state()
-
-                if T: T.write(self.trace_message(u'       ' + self.trace_node(child)))
-
-                if childstate == NODE_NO_STATE:
-                    children_not_visited.append(child)
-                elif childstate == NODE_PENDING:
-                    children_pending.add(child)
-                elif childstate == NODE_FAILED:
-                    children_failed = True
-
-                if childstate <= NODE_EXECUTING:
-                    children_not_ready.append(child)
-
-            # These nodes have not even been visited yet.  Add
-            # them to the list so that on some next pass we can
-            # take a stab at evaluating them (or their children).
-            if children_not_visited:
-                if len(children_not_visited) > 1:
-                    children_not_visited.reverse()
-                self.candidates.extend(self.order(children_not_visited))
-
-            # if T and children_not_visited:
-            #    T.write(self.trace_message('     adding to candidates: %s' % map(str, children_not_visited)))
-            #    T.write(self.trace_message('     candidates now: %s\n' % map(str, self.candidates)))
-
-            # Skip this node if any of its children have failed.
-            #
-            # This catches the case where we're descending a top-level
-            # target and one of our children failed while trying to be
-            # built by a *previous* descent of an earlier top-level
-            # target.
-            #
-            # It can also occur if a node is reused in multiple
-            # targets. One first descends though the one of the
-            # target, the next time occurs through the other target.
-            #
-            # Note that we can only have failed_children if the
-            # --keep-going flag was used, because without it the build
-            # will stop before diving in the other branch.
-            #
-            # Note that even if one of the children fails, we still
-            # added the other children to the list of candidate nodes
-            # to keep on building (--keep-going).
-            if children_failed:
-                for n in executor.get_action_targets():
-                    n.set_state(NODE_FAILED)
-
-                if S: S.child_failed = S.child_failed + 1
-                if T: T.write(self.trace_message('****** %s\n' % self.trace_node(node)))
-                continue
-
-            if children_not_ready:
-                for child in children_not_ready:
-                    # We're waiting on one or more derived targets
-                    # that have not yet finished building.
+            if self.incremental and node in self.scanned and \
+               self._scan_current(executor):
+                # We've looked at its children before and nothing has
+                # invalidated that, so the reference count tells us if
+                # any are still to be built.  If so, the last of them
+                # will put this node back on the candidates list.
+                if node.ref_count:
                     if S: S.not_built = S.not_built + 1
-
-                    # Add this node to the waiting parents lists of
-                    # anything we're waiting on, with a reference
-                    # count so we can be put back on the list for
-                    # re-evaluation when they've all finished.
-                    node.ref_count =  node.ref_count + child.add_to_waiting_parents(node)
-                    if T: T.write(self.trace_message(u'     adjusted ref count: %s, child %s' %
-                                  (self.trace_node(node), repr(str(child)))))
-
-                if T:
-                    for pc in children_pending:
-                        T.write(self.trace_message('       adding %s to the pending children set\n' %
-                                self.trace_node(pc)))
-                self.pending_children = self.pending_children | children_pending
-
-                continue
+                    if T: T.write(self.trace_message(u'       still waiting (%d children)' % node.ref_count))
+                    continue
+            else:
+                try:
+                    children = executor.get_all_children()
+                except SystemExit:
+                    exc_value = sys.exc_info()[1]
+                    e = SCons.Errors.ExplicitExit(node, exc_value.code)
+                    self.ready_exc = (SCons.Errors.ExplicitExit, e)
+                    if T: T.write(self.trace_message('       SystemExit'))
+                    return node
+                except Exception as e:
+                    # We had a problem just trying to figure out the
+                    # children (like a child couldn't be linked in to a
+                    # VariantDir, or a Scanner threw something).  Arrange to
+                    # raise the exception when the Task is "executed."
+                    self.ready_exc = sys.exc_info()
+                    if S: S.problem = S.problem + 1
+                    if T: T.write(self.trace_message('       exception %s while scanning children.\n' % e))
+                    return node
+
+                if self.incremental:
+                    self.scanned.add(node)
+
+                children_not_visited = []
+                children_pending = set()
+                children_not_ready = []
+                children_failed = False
+
+                for child in chain(executor.get_all_prerequisites(), children):
+                    childstate = child.get_state()
+
+                    if T: T.write(self.trace_message(u'       ' + self.trace_node(child)))
+
+                    if childstate == NODE_NO_STATE:
+                        children_not_visited.append(child)
+                    elif childstate == NODE_PENDING:
+                        children_pending.add(child)
+                    elif childstate == NODE_FAILED:
+                        children_failed = True
+
+                    if childstate <= NODE_EXECUTING:
+                        children_not_ready.append(child)
+
+                # These nodes have not even been visited yet.  Add
+                # them to the list so that on some next pass we can
+                # take a stab at evaluating them (or their children).
+                if children_not_visited:
+                    if self.incremental:
+                        # Only push each unvisited node once; the parents
+                        # that find it again will wait on it anyway.
+                        queued = self.queued
+                        children_not_visited = [c for c in children_not_visited
+                                                if c not in queued]
+                        queued.update(children_not_visited)
+                    if len(children_not_visited) > 1:
+                        children_not_visited.reverse()
+                    self.candidates.extend(self.order(children_not_visited))
+
+                # if T and children_not_visited:
+                #    T.write(self.trace_message('     adding to candidates: %s' % map(str, children_not_visited)))
+                #    T.write(self.trace_message('     candidates now: %s\n' % map(str, self.candidates)))
+
+                # Skip this node if any of its children have failed.
+                #
+                # This catches the case where we're descending a top-level
+                # target and one of our children failed while trying to be
+                # built by a *previous* descent of an earlier top-level
+                # target.
+                #
+                # It can also occur if a node is reused in multiple
+                # targets. One first descends though the one of the
+                # target, the next time occurs through the other target.
+                #
+                # Note that we can only have failed_children if the
+                # --keep-going flag was used, because without it the build
+                # will stop before diving in the other branch.
+                #
+                # Note that even if one of the children fails, we still
+                # added the other children to the list of candidate nodes
+                # to keep on building (--keep-going).
+                if children_failed:
+                    for n in executor.get_action_targets():
+                        n.set_state(NODE_FAILED)
+
+                    if S: S.child_failed = S.child_failed + 1
+                    if T: T.write(self.trace_message('****** %s\n' % self.trace_node(node)))
+                    continue
+
+                if children_not_ready:
+                    for child in children_not_ready:
+                        # We're waiting on one or more derived targets
+                        # that have not yet finished building.
+                        if S: S.not_built = S.not_built + 1
+
+                        # Add this node to the waiting parents lists of
+                        # anything we're waiting on, with a reference
+                        # count so we can be put back on the list for
+                        # re-evaluation when they've all finished.
+                        node.ref_count =  node.ref_count + child.add_to_waiting_parents(node)
+                        if T: T.write(self.trace_message(u'     adjusted ref count: %s, child %s' %
+                                      (self.trace_node(node), repr(str(child)))))
+
+                    if T:
+                        for pc in children_pending:
+                            T.write(self.trace_message('       adding %s to the pending children set\n' %
+                                    self.trace_node(pc)))
+                    self.pending_children = self.pending_children | children_pending
+
+                    continue
 
             # Skip this node if it has side-effects that are
             # currently being built:
@@ -961,14 +1110,68 @@ class Taskmaster(object):
 
         return None
 
-    def next_task(self):
+    def _find_next_priority_node(self):
+        """
+        Finds the ready node with the highest priority.
+
+        Ready nodes are collected in a heap, up to priority_window of
+        them, and the best one is handed out.  The first call hands out
+        the first ready node it finds, and each one after that adds at
+        most priority_refill nodes to the heap, so the window fills up
+        over the first calls instead of holding up the first task.  A node in the heap stays
+        in the pending state, so its parents wait for it just as they
+        would if it were executing; it can come up as a candidate again
+        meanwhile (it gets pushed once for every parent that finds it
+        unvisited), so the heap's members are also kept in a set.
+        """
+        if self.ready_count:
+            refill = priority_refill
+        else:
+            refill = 1
+        while refill > 0 and len(self.ready) < priority_window:
+            node = self._find_next_ready_node()
+            if node is None:
+                break
+            if node in self.ready_nodes:
+                continue
+            refill = refill - 1
+            self.ready_nodes.add(node)
+            self.ready_count = self.ready_count + 1
+            heapq.heappush(self.ready, (-self.priority(node), self.ready_count,
+                                        node, self.ready_exc))
+        if not self.ready:
+            self.ready_exc = None
+            return None
+        _, _, node, self.ready_exc = heapq.heappop(self.ready)
+        self.ready_nodes.discard(node)
+        T = self.trace
+        if T: T.write(self.trace_message(u'Taking %s from the ready nodes\n' %
+                                         self.trace_node(node)))
+        return node
+
+    def next_task(self, check=True):
         """
         Returns the next task to be executed.
 
         This simply asks for the next Node to be evaluated, and then wraps
         it in the specific Task subclass with which we were initialized.
+
+        If check is false, the task's up-to-date check is left to the
+        caller, who can run it (through ready_task()) on another thread.
+        Meanwhile the targets are marked as executing, so that they
+        aren't handed out again and their parents wait for them.  A task
+        that already has an exception recorded doesn't need the check.
         """
-        node = self._find_next_ready_node()
+        start = SCons.Timeline.now()
+
+        if self.priority is None:
+            node = self._find_next_ready_node()
+        else:
+            node = self._find_next_priority_node()
+
+        if start is not None:
+            SCons.Timeline.span('find next node', 'taskmaster', start,
+                                {'node' : str(node)})
 
         if node is None:
             return None
@@ -980,6 +1183,31 @@ class Taskmaster(object):
         tlist = executor.get_all_targets()
 
         task = self.tasker(self, tlist, node in self.original_top, node)
+        ready_exc = self.ready_exc
+        self.ready_exc = None
+
+        if check:
+            self.ready_task(task, ready_exc)
+        elif ready_exc:
+            task.exception_set(ready_exc)
+        else:
+            for t in tlist:
+                t.set_state(NODE_EXECUTING)
+
+        return task
+
+    def ready_task(self, task, ready_exc=None, worker=False):
+        """
+        Runs the up-to-date check of a task, recording any exception to
+        be raised when the task is prepared.
+
+        This doesn't touch the Taskmaster's own state, so it can be called
+        from a worker thread, with worker set.  The check then leaves the
+        targets of a task that's up to date for checked_task() to mark, in
+        the main thread.
+        """
+        start = SCons.Timeline.now()
+        task.defer_current = worker
         try:
             task.make_ready()
         except Exception as e :
@@ -987,14 +1215,26 @@ class Taskmaster(object):
             # a child couldn't be linked to a VariantDir when deciding
             # whether this node is current).  Arrange to raise the
             # exception when the Task is "executed."
-            self.ready_exc = sys.exc_info()
+            ready_exc = sys.exc_info()
 
-        if self.ready_exc:
-            task.exception_set(self.ready_exc)
+        if ready_exc:
+            task.exception_set(ready_exc)
 
-        self.ready_exc = None
+        if start is not None:
+            SCons.Timeline.span('up-to-date check', 'taskmaster', start,
+                                {'node' : str(task.node)})
 
-        return task
+    def checked_task(self, task):
+        """
+        Finishes, in the main thread, an up-to-date check that ran on a
+        worker thread.
+        """
+        task.defer_current = False
+        if task.current_pending:
+            try:
+                task.make_current()
+            except Exception:
+                task.exception_set()
 
     def will_not_build(self, nodes, node_func=lambda n: None):
         """
@@ -1046,6 +1286,12 @@ class Taskmaster(object):
         """
         self.next_candidate = self.no_next_candidate
 
+    def stopped(self):
+        """
+        Returns whether the build has been stopped.
+        """
+        return self.next_candidate == self.no_next_candidate
+
     def cleanup(self):
         """
         Check for dependency cycles.
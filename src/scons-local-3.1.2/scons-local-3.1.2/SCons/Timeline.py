@@ -0,0 +1,154 @@
+"""SCons.Timeline
+
+Records a timeline of the build in the Trace Event format, for viewing
+in chrome://tracing, Perfetto (ui.perfetto.dev) and similar tools.
+
+Each thread that does build work gets its own track: the main thread
+walks the dependency graph, and the Job worker threads execute tasks.
+Spans are recorded as "complete" events.  Code that wants to record one
+asks for a start time first and hands it back with the span:
+
+    start = SCons.Timeline.now()
+    ... do the work ...
+    if start is not None:
+        SCons.Timeline.span('scan', 'scan', start, {'node': str(node)})
+
+now() returns None unless a timeline is being recorded (--trace-events),
+so instrumented code costs next to nothing otherwise.
+"""
+
+#
+# Copyright (c) 2001 - 2019 The SCons Foundation
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY
+# KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+__revision__ = "src/engine/SCons/Timeline.py bee7caf9defd6e108fc2998a2520ddb36a967691 2019-12-17 02:07:09 bdeegan"
+
+import json
+import os.path
+import threading
+import time
+
+import SCons.Warnings
+
+# The file the timeline gets written to, or None if we're not recording.
+trace_file = None
+
+_epoch = None
+_events = []
+_tracks = {}
+_tracks_lock = threading.Lock()
+
+
+def start(path):
+    """
+    Starts recording a timeline, to be written to path by write().
+    """
+    global trace_file, _epoch
+    trace_file = os.path.abspath(path)
+    _epoch = time.time()
+    del _events[:]
+    _tracks.clear()
+
+
+def now():
+    """
+    Returns the time to start a span at, or None if we're not recording.
+    """
+    if trace_file is None:
+        return None
+    return time.time()
+
+
+def _track():
+    """
+    Returns the track number for the calling thread, numbering tracks
+    in the order threads first record something.
+    """
+    thread = threading.current_thread()
+    ident = thread.ident
+    try:
+        return _tracks[ident][0]
+    except KeyError:
+        pass
+    with _tracks_lock:
+        if ident not in _tracks:
+            _tracks[ident] = (len(_tracks) + 1, thread.name)
+        return _tracks[ident][0]
+
+
+def span(name, cat, start, args=None):
+    """
+    Records a span named 'name' in category 'cat' that started at
+    'start' (as returned by now()) and ends now.
+    """
+    if trace_file is None or start is None:
+        return
+    end = time.time()
+    event = {
+        'name' : name,
+        'cat' : cat,
+        'ph' : 'X',
+        'ts' : int((start - _epoch) * 1e6),
+        'dur' : int((end - start) * 1e6),
+        'pid' : 1,
+        'tid' : _track(),
+    }
+    if args:
+        event['args'] = args
+    # list.append() is atomic, so worker threads can record directly.
+    _events.append(event)
+
+
+def write():
+    """
+    Writes the recorded timeline to the trace file and stops recording.
+    """
+    global trace_file
+    if trace_file is None:
+        return
+    path = trace_file
+    trace_file = None
+
+    events = [{'name' : 'process_name', 'ph' : 'M', 'pid' : 1,
+               'args' : {'name' : 'scons'}}]
+    for tid, name in sorted(_tracks.values()):
+        events.append({'name' : 'thread_name', 'ph' : 'M', 'pid' : 1,
+                       'tid' : tid, 'args' : {'name' : name}})
+        events.append({'name' : 'thread_sort_index', 'ph' : 'M', 'pid' : 1,
+                       'tid' : tid, 'args' : {'sort_index' : tid}})
+    events.extend(_events)
+    del _events[:]
+
+    try:
+        with open(path, 'w') as f:
+            json.dump({'traceEvents' : events, 'displayTimeUnit' : 'ms'}, f)
+            f.write('\n')
+    except EnvironmentError as e:
+        SCons.Warnings.warn(SCons.Warnings.TimelineWarning,
+                            "Couldn't write trace events to %s: %s" %
+                            (path, e))
+
+# Local Variables:
+# tab-width:4
+# indent-tabs-mode:nil
+# End:
+# vim: set expandtab tabstop=4 shiftwidth=4:
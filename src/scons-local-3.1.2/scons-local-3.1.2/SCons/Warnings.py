@@ -44,6 +44,9 @@ class WarningOnByDefault(Warning):
 class TargetNotBuiltWarning(Warning): # Should go to OnByDefault
     pass
 
+class CacheRemoteWarning(WarningOnByDefault):
+    pass
+
 class CacheVersionWarning(WarningOnByDefault):
     pass
 
@@ -65,6 +68,9 @@ class DuplicateEnvironmentWarning(WarningOnByDefault):
 class FutureReservedVariableWarning(WarningOnByDefault):
     pass
 
+class JobserverWarning(WarningOnByDefault):
+    pass
+
 class LinkWarning(WarningOnByDefault):
     pass
 
@@ -86,6 +92,9 @@ class ReservedVariableWarning(WarningOnByDefault):
 class StackSizeWarning(WarningOnByDefault):
     pass
 
+class TimelineWarning(WarningOnByDefault):
+    pass
+
 class VisualCMissingWarning(WarningOnByDefault):
     pass
 
@@ -31,6 +31,37 @@ def is_bytes(s):
     return isinstance(s, bytes)
 
 
+def replace_file(src, dst):
+    """
+    Renames src over dst.  Where the platform allows it, this is atomic,
+    so dst holds either its old contents or the new ones even if we're
+    killed part way through.
+    """
+    if os.name != 'nt':
+        # rename() replaces an existing file atomically on POSIX.
+        os.rename(src, dst)
+        return
+    try:
+        os.replace(src, dst)
+        return
+    except (AttributeError, OSError):
+        # Python 2 has no replace(), and neither call can rename over a
+        # read-only file.
+        pass
+    # Windows doesn't allow renaming if the file exists, so unlink it
+    # first, chmod'ing it to make sure we can do so.  This leaves a
+    # moment with no dst at all.
+    try:
+        os.chmod(dst, 0o777)
+    except OSError:
+        pass
+    try:
+        os.unlink(dst)
+    except OSError:
+        pass
+    os.rename(src, dst)
+
+
 try:
     unicode('a')
 except NameError:
@@ -148,18 +179,10 @@ class dblite(object):
         self._pickle_dump(self._dict, f, self._pickle_protocol)
         f.close()
 
-        # Windows doesn't allow renaming if the file exists, so unlink
-        # it first, chmod'ing it to make sure we can do so.  On UNIX, we
-        # may not be able to chmod the file if it's owned by someone else
-        # (e.g. from a previous run as root).  We should still be able to
-        # unlink() the file if the directory's writable, though, so ignore
-        # any OSError exception  thrown by the chmod() call.
-        try:
-            self._os_chmod(self._file_name, 0o777)
-        except OSError:
-            pass
-        self._os_unlink(self._file_name)
-        self._os_rename(self._tmp_name, self._file_name)
+        # Rename the new file over the old one, rather than unlinking
+        # the old one first, so a build killed in between (for instance
+        # during a checkpoint) doesn't lose the whole database.
+        replace_file(self._tmp_name, self._file_name)
         if self._os_chown is not None and self._chown_to > 0:  # don't chown to root or -1
             try:
                 self._os_chown(self._file_name, self._chown_to, self._chgrp_to)
@@ -187,6 +210,11 @@ class dblite(object):
         self._dict[key] = value
         self._needs_sync = 0o001
 
+    def __delitem__(self, key):
+        self._check_writable()
+        del self._dict[key]
+        self._needs_sync = 0o001
+
     def keys(self):
         return list(self._dict.keys())
 
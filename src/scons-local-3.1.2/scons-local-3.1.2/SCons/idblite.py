@@ -0,0 +1,333 @@
+"""SCons.idblite
+
+An indexed, lazily loaded variant of the SCons.dblite database module.
+
+SCons.dblite reads and unpickles the whole database when it's opened,
+even if the build only looks at a handful of directories.  This module
+stores the same key -> value mapping in a file that starts with an index
+of (key, offset, length) records followed by the raw values.  On open,
+the file is memory-mapped and only the index is parsed; a value is
+copied out of the map the first time SConsign.DB asks for it, so a
+build of one subtree does I/O and memory work in proportion to that
+subtree rather than to the whole project.
+
+Changed values are held in memory until sync(), which writes a new file
+(unchanged values are copied straight from the old map without being
+decoded) and renames it into place.  If nothing changed, sync() doesn't
+touch the file at all.
+
+When no indexed file exists yet but a plain .dblite database of the
+same name does, its contents are imported on first open.
+
+To use it:
+
+    import SCons.idblite
+    SConsignFile(dbm_module=SCons.idblite)
+"""
+
+#
+# Copyright (c) 2001 - 2019 The SCons Foundation
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY
+# KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+__revision__ = "src/engine/SCons/idblite.py bee7caf9defd6e108fc2998a2520ddb36a967691 2019-12-17 02:07:09 bdeegan"
+
+import mmap
+import os
+import struct
+
+import SCons.dblite
+
+idblite_suffix = '.idblite'
+tmp_suffix = '.idbtmp'
+
+magic = b'SConsIdx'
+format_version = 1
+
+# File header: magic, format version, number of records, size of the
+# index area in bytes.  The index follows the header, the values follow
+# the index.
+_file_header = struct.Struct('>8sIIQ')
+
+# Index record: key length, value offset (from the start of the file),
+# value length.  The UTF-8 encoded key follows each record.
+_index_record = struct.Struct('>IQQ')
+
+
+class CorruptIndexError(ValueError):
+    pass
+
+
+class idblite(object):
+    """
+    A dbm-like object backed by a memory-mapped, indexed file.
+
+    As with SCons.dblite, references to the module-level functions used
+    by sync() are squirrelled away as class attributes, because sync()
+    may be called from __del__() while Python is tearing down modules.
+    """
+
+    _open = open
+    _mmap = staticmethod(mmap.mmap)
+    _pack_header = staticmethod(_file_header.pack)
+    _pack_record = staticmethod(_index_record.pack)
+    try:
+        _os_chown = os.chown
+    except AttributeError:
+        _os_chown = None
+
+    def __init__(self, file_base_name, flag, mode):
+        assert flag in (None, "r", "w", "c", "n")
+        if flag is None:
+            flag = "r"
+
+        base, ext = os.path.splitext(file_base_name)
+        if ext == idblite_suffix:
+            self._file_name = file_base_name
+            self._tmp_name = base + tmp_suffix
+        else:
+            base = file_base_name
+            self._file_name = file_base_name + idblite_suffix
+            self._tmp_name = file_base_name + tmp_suffix
+
+        self._flag = flag
+        self._mode = mode
+        self._map = None
+        self._index = {}
+        self._dict = {}
+        self._deleted = set()
+        self._needs_sync = 0
+
+        if self._os_chown is not None and (os.geteuid() == 0 or os.getuid() == 0):
+            try:
+                statinfo = os.stat(self._file_name)
+                self._chown_to = statinfo.st_uid
+                self._chgrp_to = statinfo.st_gid
+            except OSError:
+                self._chown_to = int(os.environ.get('SUDO_UID', -1))
+                self._chgrp_to = int(os.environ.get('SUDO_GID', -1))
+        else:
+            self._chown_to = -1
+            self._chgrp_to = -1
+
+        if self._flag == "n":
+            self._needs_sync = 1
+            return
+
+        try:
+            f = self._open(self._file_name, "rb")
+        except IOError as e:
+            if self._flag != "c":
+                raise e
+            self._import_dblite(base)
+            self._needs_sync = 1
+            return
+
+        try:
+            self._load_index(f)
+        except (CorruptIndexError, struct.error, ValueError,
+                EnvironmentError):
+            self._index = {}
+            self._close_map()
+            if SCons.dblite.ignore_corrupt_dbfiles == 0:
+                raise
+            if SCons.dblite.ignore_corrupt_dbfiles == 1:
+                SCons.dblite.corruption_warning(self._file_name)
+        finally:
+            f.close()
+
+    def _load_index(self, f):
+        """
+        Maps the file and parses its index.  The values themselves are
+        not read until they are asked for.
+        """
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return
+        if size < _file_header.size:
+            raise CorruptIndexError(self._file_name)
+        self._map = self._mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        m = self._map
+        hmagic, version, count, index_size = _file_header.unpack_from(m, 0)
+        if hmagic != magic or version != format_version:
+            raise CorruptIndexError(self._file_name)
+        data_start = _file_header.size + index_size
+        if data_start > size:
+            raise CorruptIndexError(self._file_name)
+        offset = _file_header.size
+        rsize = _index_record.size
+        index = {}
+        for _ in range(count):
+            klen, voffset, vlen = _index_record.unpack_from(m, offset)
+            offset = offset + rsize
+            key = m[offset:offset + klen].decode('utf-8')
+            offset = offset + klen
+            if voffset < data_start or voffset + vlen > size:
+                raise CorruptIndexError(self._file_name)
+            index[key] = (voffset, vlen)
+        self._index = index
+
+    def _import_dblite(self, base):
+        """
+        Pulls in the contents of a plain dblite database with the same
+        base name, so switching modules doesn't throw away signatures.
+        """
+        if not os.path.exists(base + SCons.dblite.dblite_suffix):
+            return
+        try:
+            old = SCons.dblite.open(base, "r")
+        except Exception:
+            return
+        for key in old.keys():
+            self._dict[key] = old[key]
+
+    def _close_map(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def close(self):
+        if self._needs_sync:
+            self.sync()
+        self._close_map()
+
+    def __del__(self):
+        self.close()
+
+    def _check_writable(self):
+        if self._flag == "r":
+            raise IOError("Read-only database: %s" % self._file_name)
+
+    def _get_value(self, key):
+        try:
+            return self._dict[key]
+        except KeyError:
+            pass
+        if key in self._deleted:
+            raise KeyError(key)
+        offset, length = self._index[key]
+        return self._map[offset:offset + length]
+
+    def sync(self):
+        if not self._needs_sync:
+            return
+        self._check_writable()
+
+        keys = sorted(self.keys())
+        encoded = [k.encode('utf-8') for k in keys]
+        index_size = sum(_index_record.size + len(k) for k in encoded)
+        offset = _file_header.size + index_size
+
+        records = []
+        for key, ekey in zip(keys, encoded):
+            try:
+                length = len(self._dict[key])
+            except KeyError:
+                length = self._index[key][1]
+            records.append(self._pack_record(len(ekey), offset, length))
+            records.append(ekey)
+            offset = offset + length
+
+        f = self._open(self._tmp_name, "wb")
+        try:
+            f.write(self._pack_header(magic, format_version,
+                                      len(keys), index_size))
+            f.write(b''.join(records))
+            for key in keys:
+                f.write(self._get_value(key))
+        finally:
+            f.close()
+
+        self._close_map()
+        SCons.dblite.replace_file(self._tmp_name, self._file_name)
+        if self._os_chown is not None and self._chown_to > 0:
+            try:
+                self._os_chown(self._file_name, self._chown_to, self._chgrp_to)
+            except OSError:
+                pass
+
+        self._dict = {}
+        self._deleted = set()
+        self._index = {}
+        f = self._open(self._file_name, "rb")
+        try:
+            self._load_index(f)
+        finally:
+            f.close()
+        self._needs_sync = 0
+
+    def __getitem__(self, key):
+        return self._get_value(key)
+
+    def __setitem__(self, key, value):
+        self._check_writable()
+        if not SCons.dblite.is_string(key):
+            raise TypeError("key `%s' must be a string but is %s" % (key, type(key)))
+        if not SCons.dblite.is_bytes(value):
+            raise TypeError("value `%s' must be a bytes but is %s" % (value, type(value)))
+        # SConsign stores every directory it visited, even when nothing
+        # in it changed; don't rewrite the file for those.
+        try:
+            if self._get_value(key) == value:
+                return
+        except KeyError:
+            pass
+        self._dict[key] = value
+        self._deleted.discard(key)
+        self._needs_sync = 1
+
+    def __delitem__(self, key):
+        self._check_writable()
+        if key not in self:
+            raise KeyError(key)
+        self._dict.pop(key, None)
+        if key in self._index:
+            self._deleted.add(key)
+        self._needs_sync = 1
+
+    def keys(self):
+        result = set(self._index.keys()) - self._deleted
+        result.update(self._dict.keys())
+        return list(result)
+
+    def has_key(self, key):
+        return key in self
+
+    def __contains__(self, key):
+        if key in self._dict:
+            return True
+        return key in self._index and key not in self._deleted
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+
+def open(file, flag=None, mode=0o666):
+    return idblite(file, flag, mode)
+
+# Local Variables:
+# tab-width:4
+# indent-tabs-mode:nil
+# End:
+# vim: set expandtab tabstop=4 shiftwidth=4:
@@ -0,0 +1,272 @@
+"""SCons.jdblite
+
+A journaled variant of the SCons.dblite database module.
+
+The plain dblite module re-pickles its whole dictionary into a temporary
+file on every sync().  For a large .sconsign.dblite file that means every
+incremental build pays for serializing the signatures of the entire tree,
+even if only one directory's entry changed.
+
+This module keeps the regular .dblite file as a base snapshot and writes
+only the records that changed since the last sync to an append-only
+journal file next to it (.sconsign.dblite.journal).  Each journal record
+carries its length and a CRC, so a journal whose tail was cut short by
+an interrupted build is recovered by replaying every complete record and
+discarding the rest.  Once the journal grows past a size threshold the
+next sync() compacts it:  the full dictionary is rewritten to the base
+file (exactly as dblite does) and the journal is removed.  The journal
+starts with a stamp identifying the base file it was written against,
+so a journal that outlived its base file is never replayed on top of a
+newer one.
+
+Because the base file is an ordinary dblite file, switching back to
+SCons.dblite only loses the journaled changes that were not compacted.
+
+To use it:
+
+    import SCons.jdblite
+    SConsignFile(dbm_module=SCons.jdblite)
+"""
+
+#
+# Copyright (c) 2001 - 2019 The SCons Foundation
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY
+# KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+__revision__ = "src/engine/SCons/jdblite.py bee7caf9defd6e108fc2998a2520ddb36a967691 2019-12-17 02:07:09 bdeegan"
+
+import os
+import pickle
+import struct
+import zlib
+
+import SCons.dblite
+
+journal_suffix = '.journal'
+
+# The journal gets compacted into the base file on the next sync() once
+# it is larger than compact_threshold bytes *and* larger than
+# compact_ratio times the size of the base file.  The ratio keeps huge
+# databases from being rewritten too often; the absolute threshold keeps
+# tiny databases from being rewritten on every sync.
+compact_threshold = 4 * 1024 * 1024
+compact_ratio = 0.5
+
+# Each journal record is a fixed header (payload length, CRC-32 of the
+# payload) followed by the pickled (key, value) payload.  A value of
+# None records that the key was deleted.
+_record_header = struct.Struct('>II')
+
+# The journal starts with a magic string and the stamp (size,
+# modification time in nanoseconds, inode number) of the base file the
+# records apply to.
+_journal_magic = b'SCONSJNL'
+_journal_header = struct.Struct('>8sQQQ')
+
+
+def _base_stamp(st):
+    try:
+        mtime = st.st_mtime_ns
+    except AttributeError:
+        mtime = int(st.st_mtime * 1000000000)
+    return (st.st_size, mtime, st.st_ino)
+
+
+class jdblite(SCons.dblite.dblite):
+    """
+    A dblite database that appends changed records to a journal on
+    sync() instead of rewriting the whole file.
+
+    As in the base class, references to the module-level functions we
+    use from sync() are squirrelled away as class attributes, because
+    sync() may be called from __del__() during interpreter shutdown.
+    """
+
+    _pickle_dumps = staticmethod(pickle.dumps)
+    _pack_header = staticmethod(_record_header.pack)
+    _pack_journal_header = staticmethod(_journal_header.pack)
+    _crc32 = staticmethod(zlib.crc32)
+
+    try:
+        _os_fsync = os.fsync
+    except AttributeError:
+        _os_fsync = None
+
+    _os_stat = os.stat
+
+    def __init__(self, file_base_name, flag, mode):
+        SCons.dblite.dblite.__init__(self, file_base_name, flag, mode)
+
+        self._journal_name = self._file_name + journal_suffix
+        self._changed = set()
+        self._journal_size = 0
+        self._stat_base()
+
+        if self._flag == "n":
+            self._remove_journal()
+        else:
+            self._replay_journal()
+
+    def _replay_journal(self):
+        """
+        Applies the records in the journal to the dictionary loaded from
+        the base file.
+
+        A journal whose stamp doesn't match the base file belongs to an
+        earlier base file, and is thrown away.  Replay stops at the first
+        record that is incomplete or fails its CRC check; that is what's
+        left behind when a build gets killed in the middle of a sync().
+        If we're allowed to write, the journal is truncated back to the
+        last good record so later appends don't land after the garbage.
+        """
+        try:
+            with self._open(self._journal_name, 'rb') as f:
+                data = f.read()
+        except (IOError, OSError):
+            return
+
+        offset = _journal_header.size
+        if len(data) < offset or \
+           _journal_header.unpack_from(data, 0) != \
+               (_journal_magic,) + self._base_stamp:
+            if self._flag != "r":
+                self._remove_journal()
+            return
+
+        hsize = _record_header.size
+        end = len(data)
+        while offset + hsize <= end:
+            length, crc = _record_header.unpack_from(data, offset)
+            start = offset + hsize
+            if start + length > end:
+                break
+            payload = data[start:start + length]
+            if zlib.crc32(payload) & 0xffffffff != crc:
+                break
+            try:
+                if bytes is not str:
+                    key, value = pickle.loads(payload, encoding='bytes')
+                else:
+                    key, value = pickle.loads(payload)
+            except Exception:
+                break
+            if value is None:
+                self._dict.pop(key, None)
+            else:
+                self._dict[key] = value
+            offset = start + length
+
+        if offset < end:
+            SCons.dblite.corruption_warning(self._journal_name)
+            if self._flag != "r":
+                with self._open(self._journal_name, 'r+b') as f:
+                    f.truncate(offset)
+        self._journal_size = offset
+
+    def _remove_journal(self):
+        try:
+            self._os_unlink(self._journal_name)
+        except OSError:
+            pass
+        self._journal_size = 0
+
+    def _stat_base(self):
+        try:
+            st = self._os_stat(self._file_name)
+        except OSError:
+            self._base_size = 0
+            self._base_stamp = (0, 0, 0)
+        else:
+            self._base_size = st.st_size
+            self._base_stamp = _base_stamp(st)
+
+    def __setitem__(self, key, value):
+        # SConsign rewrites the entry of every directory it visited, even
+        # on a null build, so only journal the ones that really changed.
+        if self._dict.get(key) == value:
+            self._check_writable()
+            return
+        SCons.dblite.dblite.__setitem__(self, key, value)
+        self._changed.add(key)
+
+    def __delitem__(self, key):
+        SCons.dblite.dblite.__delitem__(self, key)
+        self._changed.add(key)
+
+    def _needs_compaction(self):
+        if self._journal_size < compact_threshold:
+            return False
+        return self._journal_size > compact_ratio * self._base_size
+
+    def compact(self):
+        """
+        Rewrites the full dictionary to the base file and discards the
+        journal.
+
+        If we get interrupted between the two steps, the journal left
+        behind still carries the stamp of the old base file, so it is
+        discarded rather than replayed: replaying it could bring back
+        values the new base file has already replaced.
+        """
+        self._check_writable()
+        SCons.dblite.dblite.sync(self)
+        self._remove_journal()
+        self._changed = set()
+        self._stat_base()
+
+    def sync(self):
+        self._check_writable()
+        if self._needs_compaction():
+            self.compact()
+            return
+        if self._changed:
+            records = []
+            if not self._journal_size:
+                records.append(self._pack_journal_header(
+                    *((_journal_magic,) + self._base_stamp)))
+            for key in self._changed:
+                payload = self._pickle_dumps((key, self._dict.get(key)),
+                                             self._pickle_protocol)
+                crc = self._crc32(payload) & 0xffffffff
+                records.append(self._pack_header(len(payload), crc))
+                records.append(payload)
+            data = b''.join(records)
+            f = self._open(self._journal_name, "ab")
+            try:
+                f.write(data)
+                f.flush()
+                if self._os_fsync is not None:
+                    self._os_fsync(f.fileno())
+            finally:
+                f.close()
+            self._journal_size = self._journal_size + len(data)
+            self._changed = set()
+        self._needs_sync = 0
+
+
+def open(file, flag=None, mode=0o666):
+    return jdblite(file, flag, mode)
+
+# Local Variables:
+# tab-width:4
+# indent-tabs-mode:nil
+# End:
+# vim: set expandtab tabstop=4 shiftwidth=4:
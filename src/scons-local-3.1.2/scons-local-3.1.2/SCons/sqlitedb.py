@@ -0,0 +1,256 @@
+"""SCons.sqlitedb
+
+An SQLite-backed dbm-like module for storing .sconsign information.
+
+Each directory's signature entries are kept in their own row, so a sync()
+only writes the rows that changed since the last one, and it writes them
+in a single transaction.  The database runs in WAL mode, which lets other
+processes (IDE tooling, the sconsign script) read it while a build is
+writing to it without blocking either side.
+
+To use it:
+
+    import SCons.sqlitedb
+    SConsignFile(dbm_module=SCons.sqlitedb)
+"""
+
+#
+# Copyright (c) 2001 - 2019 The SCons Foundation
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY
+# KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+__revision__ = "src/engine/SCons/sqlitedb.py bee7caf9defd6e108fc2998a2520ddb36a967691 2019-12-17 02:07:09 bdeegan"
+
+import os
+import sqlite3
+
+import SCons.dblite
+
+sqlite_suffix = '.sqlite'
+
+# The files SQLite keeps next to a database, which it replays into the
+# database when it opens it.
+sidecar_suffixes = ('-wal', '-shm', '-journal')
+
+# How long (in milliseconds) a writer waits for another writer's
+# transaction to finish before giving up.
+busy_timeout = 30000
+
+
+class sqlitedb(object):
+    """
+    A dbm-like object that keeps one row per .sconsign directory key.
+
+    Values set through __setitem__() are buffered and written by sync()
+    in one transaction; values that compare equal to what's already in
+    the database are not written at all.
+    """
+
+    def __init__(self, file_base_name, flag, mode):
+        assert flag in (None, "r", "w", "c", "n")
+        if flag is None:
+            flag = "r"
+
+        base, ext = os.path.splitext(file_base_name)
+        if ext == sqlite_suffix:
+            self._file_name = file_base_name
+        else:
+            self._file_name = file_base_name + sqlite_suffix
+
+        self._flag = flag
+        self._mode = mode
+        self._pending = {}
+        self._deleted = set()
+        self._seen = {}
+        self._conn = None
+
+        if flag in ("r", "w") and not os.path.exists(self._file_name):
+            raise IOError("No such file or directory: '%s'" % self._file_name)
+
+        try:
+            self._create()
+            self._connect()
+        except sqlite3.DatabaseError:
+            if SCons.dblite.ignore_corrupt_dbfiles == 0 or flag == "r":
+                raise
+            if SCons.dblite.ignore_corrupt_dbfiles == 1:
+                SCons.dblite.corruption_warning(self._file_name)
+            self._close_connection()
+            self._remove()
+            self._create()
+            self._connect()
+
+        if flag == "n":
+            self._conn.execute("DELETE FROM sconsign")
+            self._conn.commit()
+
+    def _create(self):
+        # Create a new database file ourselves, so it gets the permissions
+        # asked for (less the umask); SQLite gives the files it keeps next
+        # to it the same ones.
+        if self._flag != "r" and not os.path.exists(self._file_name):
+            os.close(os.open(self._file_name, os.O_WRONLY | os.O_CREAT,
+                             self._mode))
+
+    def _remove(self):
+        # A stale write-ahead log or journal left next to the file would
+        # be replayed into the fresh database, so they go too.
+        for name in [self._file_name] + \
+                    [self._file_name + s for s in sidecar_suffixes]:
+            try:
+                os.unlink(name)
+            except OSError:
+                if os.path.exists(name):
+                    raise
+
+    def _connect(self):
+        if self._flag == "r":
+            try:
+                uri = 'file:%s?mode=ro' % self._file_name.replace('?', '%3f')
+                self._conn = sqlite3.connect(uri, uri=True,
+                                             check_same_thread=False)
+            except TypeError:
+                # Python 2 doesn't know about URI file names.
+                self._conn = sqlite3.connect(self._file_name,
+                                             check_same_thread=False)
+        else:
+            self._conn = sqlite3.connect(self._file_name,
+                                         check_same_thread=False)
+        self._conn.text_factory = str
+        self._conn.execute("PRAGMA busy_timeout = %d" % busy_timeout)
+        if self._flag != "r":
+            self._conn.execute("PRAGMA journal_mode = WAL")
+            self._conn.execute("PRAGMA synchronous = NORMAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS sconsign "
+                               "(dir TEXT PRIMARY KEY, entries BLOB NOT NULL)")
+            self._conn.commit()
+        # Make sure this really is a database we can read.
+        self._conn.execute("SELECT COUNT(*) FROM sconsign").fetchone()
+
+    def _close_connection(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _check_writable(self):
+        if self._flag == "r":
+            raise IOError("Read-only database: %s" % self._file_name)
+
+    def close(self):
+        if self._conn is None:
+            return
+        if self._pending or self._deleted:
+            self.sync()
+        self._close_connection()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def sync(self):
+        self._check_writable()
+        if not (self._pending or self._deleted):
+            return
+        conn = self._conn
+        with conn:
+            if self._deleted:
+                conn.executemany("DELETE FROM sconsign WHERE dir = ?",
+                                 [(k,) for k in self._deleted])
+            if self._pending:
+                conn.executemany("INSERT OR REPLACE INTO sconsign "
+                                 "(dir, entries) VALUES (?, ?)",
+                                 [(k, sqlite3.Binary(v))
+                                  for k, v in self._pending.items()])
+        self._seen.update(self._pending)
+        self._pending = {}
+        self._deleted = set()
+
+    def __getitem__(self, key):
+        try:
+            return self._pending[key]
+        except KeyError:
+            pass
+        if key in self._deleted:
+            raise KeyError(key)
+        try:
+            return self._seen[key]
+        except KeyError:
+            pass
+        row = self._conn.execute("SELECT entries FROM sconsign WHERE dir = ?",
+                                 (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        value = bytes(row[0])
+        self._seen[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self._check_writable()
+        if not SCons.dblite.is_string(key):
+            raise TypeError("key `%s' must be a string but is %s" % (key, type(key)))
+        if not SCons.dblite.is_bytes(value):
+            raise TypeError("value `%s' must be a bytes but is %s" % (value, type(value)))
+        self._deleted.discard(key)
+        if key not in self._pending and self._seen.get(key) == value:
+            return
+        self._pending[key] = value
+
+    def __delitem__(self, key):
+        self._check_writable()
+        if key not in self:
+            raise KeyError(key)
+        self._pending.pop(key, None)
+        self._seen.pop(key, None)
+        self._deleted.add(key)
+
+    def keys(self):
+        rows = self._conn.execute("SELECT dir FROM sconsign").fetchall()
+        result = set([r[0] for r in rows]) - self._deleted
+        result.update(self._pending.keys())
+        return list(result)
+
+    def has_key(self, key):
+        return key in self
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+
+def open(file, flag=None, mode=0o666):
+    return sqlitedb(file, flag, mode)
+
+# Local Variables:
+# tab-width:4
+# indent-tabs-mode:nil
+# End:
+# vim: set expandtab tabstop=4 shiftwidth=4:
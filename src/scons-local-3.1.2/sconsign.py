@@ -197,10 +197,18 @@ import SCons.SConsign
 
 
 def my_whichdb(filename):
+    if filename[-7:] == ".sqlite" or os.path.exists(filename + ".sqlite"):
+        return "SCons.sqlitedb"
+    if filename[-8:] == ".idblite" or os.path.exists(filename + ".idblite"):
+        return "SCons.idblite"
     if filename[-7:] == ".dblite":
+        if os.path.exists(filename + ".journal"):
+            return "SCons.jdblite"
         return "SCons.dblite"
     try:
         with open(filename + ".dblite", "rb"):
+            if os.path.exists(filename + ".dblite.journal"):
+                return "SCons.jdblite"
             return "SCons.dblite"
     except IOError:
         pass
@@ -513,7 +521,7 @@ class Do_SConsignDB(object):
             print('=== ' + dir + ':')
         except TypeError:
             print('=== ' + dir.decode() + ':')
-        printentries(pickle.loads(val), dir)
+        printentries(SCons.SConsign.decode_entries(val), dir)
 
 
 def Do_SConsignDir(name):
@@ -582,7 +590,11 @@ for o, a in opts:
     elif o in ('-f', '--format'):
         # Try to map the given DB format to a known module
         # name, that we can then try to import...
-        Module_Map = {'dblite': 'SCons.dblite', 'sconsign': None}
+        Module_Map = {'dblite': 'SCons.dblite',
+                      'jdblite': 'SCons.jdblite',
+                      'idblite': 'SCons.idblite',
+                      'sqlite': 'SCons.sqlitedb',
+                      'sconsign': None}
         dbm_name = Module_Map.get(a, a)
         if dbm_name:
             try:
@@ -628,7 +640,10 @@ else:
     for a in args:
         dbm_name = whichdb(a)
         if dbm_name:
-            Map_Module = {'SCons.dblite': 'dblite'}
+            Map_Module = {'SCons.dblite': 'dblite',
+                          'SCons.jdblite': 'jdblite',
+                          'SCons.idblite': 'idblite',
+                          'SCons.sqlitedb': 'sqlite'}
             if dbm_name != "SCons.dblite":
                 dbm = my_import(dbm_name)
             else: